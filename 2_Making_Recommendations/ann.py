@@ -0,0 +1,169 @@
+# -*- coding:utf-8 -*-
+
+"""
+基于MinHash分段（banding）的近似最近邻索引（LSH）。
+
+sim_pearson和sim_distance都只在共同评价过的物品上计算，没有共同评价物品的用户
+相似度总是0，所以按评价过的物品集合做MinHash，而不是按评分向量的方向。
+每个物品按名称确定性地得到bands×rows个哈希值，用户的签名是其评价过的物品上
+每个哈希值的最小值，分成bands段，每段作为一张哈希表的桶。两个用户在一段上相同的
+概率是物品集合的Jaccard系数的rows次方。
+
+查询时统计其他用户与目标在多少段上落入同一个桶，由此估计共同评价的物品数，
+只保留估计值最小的budget个用户，再用精确的相似度函数重新打分，结果格式与
+topMatches相同：
+
+    index = LSHIndex(bands=256, rows=1, budget=200)
+    index.addAll(prefs)
+    index.topMatches(prefs, '87', n=5)
+    getRecommendations(prefs, '87', index=index)
+
+保留共同评价物品少的候选，是因为这两个相似度在共同评价的物品很少时最容易取到
+极值：在u.data上皮尔逊系数和欧氏距离的前10名大多只有1~3个共同评价物品，
+按碰撞次数从多到少选取候选的召回率还不如随机抽样。
+每次查询精确打分的用户数不超过budget，与用户总数无关；统计碰撞次数的开销与
+各段桶的大小之和成正比。向量化后端（见simmatrix）只计算候选对应的列。
+在u.data上，默认参数的recall@10（见recall）约为0.88/0.93（皮尔逊/欧氏距离），
+每次查询检查约21%的用户，纯Python后端约6毫秒，精确的topMatches约34毫秒；
+向量化后端的完整扫描本来就只要约3毫秒，用索引没有收益。按benchmark.py放大10倍的
+合成数据上，纯Python后端约11毫秒对240毫秒，向量化后端约6毫秒对8毫秒，
+但相同的budget下recall@10降到约0.5：相似度取到极值的用户随用户数增加，
+要保持召回率需要按比例增大budget。budget为None时保留所有至少碰撞一次的用户。
+rows大于1时桶更小，但共同评价物品少的用户更难碰撞。
+用benchmark.py的annTopMatches在自己的数据上比较召回率和延迟。
+新增的用户和物品都可以随时插入，不需要预先知道物品总数。
+"""
+
+import zlib
+import numpy as np
+from recommendations import sim_pearson, topMatches as exactTopMatches, topN
+
+_empty = np.zeros(0, dtype=np.intp)
+
+
+class LSHIndex:
+    def __init__(self, bands=256, rows=1, budget=200, seed=0):
+        """
+        :param bands: 哈希表的数量
+        :param rows: 每张哈希表使用的MinHash个数
+        :param budget: 每次查询最多精确打分的候选数，None表示不限制
+        :param seed: 随机种子，决定物品的哈希值
+        """
+        self.bands = bands
+        self.rows = rows
+        self.budget = budget
+        self.seed = seed
+        self.hashes = {}
+        # 桶中保存键的整数编号组成的数组，查询时拼接起来统计碰撞次数
+        self.buckets = [{} for b in range(bands)]
+        self.ids = {}
+        self.keys = []
+        self.signatures = {}
+        # 每个编号的键评价过的物品数，用于估计共同评价的物品数
+        self.sizes = np.zeros(16)
+
+    def _hash(self, item):
+        """
+        物品item的所有MinHash哈希值
+        """
+        if item not in self.hashes:
+            key = item.encode('utf-8') if isinstance(item, unicode) else repr(item)
+            rng = np.random.RandomState((zlib.crc32(key) ^ self.seed) & 0xffffffff)
+            self.hashes[item] = rng.randint(0, 2 ** 31 - 1, self.bands * self.rows)
+        return self.hashes[item]
+
+    def signature(self, vec):
+        """
+        :param vec: 评分向量，{物品: 评分}
+        :return: 每张哈希表中的桶，没有评分时为空
+        """
+        if not vec:
+            return ()
+        mins = np.array([self._hash(item) for item in vec]).min(axis=0).reshape(self.bands, self.rows)
+        return tuple(tuple(band) for band in mins.tolist())
+
+    def add(self, key, vec):
+        """
+        插入或更新一个向量
+        """
+        self.remove(key)
+        if key not in self.ids:
+            self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            if len(self.keys) > len(self.sizes):
+                self.sizes = np.resize(self.sizes, 2 * len(self.keys))
+        i = self.ids[key]
+        sig = self.signature(vec)
+        self.signatures[key] = sig
+        self.sizes[i] = len(vec)
+        for table, bucket in zip(self.buckets, sig):
+            table[bucket] = np.append(table.get(bucket, _empty), i)
+
+    def addAll(self, prefs):
+        for key in prefs:
+            self.add(key, prefs[key])
+
+    def remove(self, key):
+        sig = self.signatures.pop(key, None)
+        if sig is None:
+            return
+        i = self.ids[key]
+        for table, bucket in zip(self.buckets, sig):
+            rest = table[bucket][table[bucket] != i]
+            if len(rest):
+                table[bucket] = rest
+            else:
+                del table[bucket]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def candidates(self, prefs, person):
+        """
+        与person至少在一张哈希表中落入同一个桶的键，不包含person本身。
+        超过budget个时只保留估计的共同评价物品数最少的budget个
+        """
+        sig = self.signatures.get(person)
+        if sig is None:
+            sig = self.signature(prefs[person])
+        ids = np.concatenate([table.get(bucket, _empty) for table, bucket in zip(self.buckets, sig)] or [_empty])
+        found, counts = np.unique(ids, return_counts=True)
+        others = found != self.ids.get(person, -1)
+        found, counts = found[others], counts[others]
+        if self.budget is not None and len(found) > self.budget:
+            # 碰撞的比例约为Jaccard系数的rows次方，
+            # 共同评价的物品数 = J / (1 + J) * (|A| + |B|)
+            jaccard = (counts / float(self.bands)) ** (1.0 / self.rows)
+            estimates = jaccard / (1 + jaccard) * (len(prefs[person]) + self.sizes[found])
+            found = found[np.argsort(estimates, kind='mergesort')[:self.budget]]
+        return [self.keys[i] for i in found]
+
+    def topMatches(self, prefs, person, n=5, similarity=sim_pearson):
+        """
+        与recommendations.topMatches相同，但只对候选集精确打分。
+        向量化后端（见simmatrix）只计算候选对应的列
+        """
+        others = [other for other in self.candidates(prefs, person) if other in prefs]
+        if hasattr(similarity, 'scores'):
+            scores = similarity.scores(prefs, person, others)
+        else:
+            scores = [(similarity(prefs, person, other), other) for other in others]
+        return topN(scores, n)
+
+
+def recall(index, prefs, people, n=10, similarity=sim_pearson):
+    """
+    近似结果相对于精确topMatches的平均recall@n。
+    前n名中常有大量相似度相同的用户，所以按分数而不是按用户比较：
+    近似结果第r名的分数达到精确结果第r名的分数即算命中
+    :param index: 提供topMatches方法的近似索引
+    :param people: 参与评估的用户
+    :return: 0到1之间的召回率
+    """
+    hits = total = 0
+    for person in people:
+        exact = exactTopMatches(prefs, person, n, similarity)
+        approx = index.topMatches(prefs, person, n, similarity)
+        hits += sum(1 for a, e in zip(approx, exact) if a[0] >= e[0] - 1e-12)
+        total += len(exact)
+    return float(hits) / total if total else 1.0
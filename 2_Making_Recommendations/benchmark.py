@@ -0,0 +1,193 @@
+# -*- coding:utf-8 -*-
+
+"""
+推荐算法的性能基准测试。
+
+在u.data以及按相同稀疏度放大10倍、100倍的合成数据上，测量sim_pearson、
+topMatches、getRecommendations、calculateSimilarItems和getRecommendedItems的
+p50/p99延迟、吞吐量和峰值内存，结果以JSON输出，便于比较不同版本和不同后端。
+annTopMatches测量近似索引（见ann.LSHIndex）的延迟，同时报告相对于精确topMatches的
+recall@10和每次查询检查的用户比例：
+
+    python benchmark.py --scales 1 10 --backend python matrix --output bench.json
+
+每个测试项在单独的子进程中运行，峰值内存互不影响。相同的--seed得到相同的数据和
+调用顺序。注意纯Python后端在大数据集上的calculateSimilarItems非常慢。
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+import numpy as np
+
+import ann
+import recommendations
+import simmatrix
+from movielens import loadRatings
+
+FUNCTIONS = ['sim_pearson', 'topMatches', 'annTopMatches', 'getRecommendations',
+             'calculateSimilarItems', 'getRecommendedItems']
+BACKENDS = {
+    'python': (recommendations.sim_pearson, recommendations.sim_distance),
+    'matrix': (simmatrix.sim_pearson_matrix, simmatrix.sim_distance_matrix),
+}
+
+
+def synthesize(prefs, scale, seed=0):
+    """
+    生成评分数为prefs的scale倍、稀疏度相同的合成数据集。
+    用户数和物品数各放大sqrt(scale)倍，每个用户的评分数、物品的流行度和
+    平均评分都从原始数据中抽样
+    :param prefs: 原始数据集
+    :param scale: 放大倍数
+    :param seed:
+    :return: 合成的数据集
+    """
+    if scale == 1:
+        return prefs
+    rng = np.random.RandomState(seed)
+    factor = np.sqrt(scale)
+    counts = np.array([len(prefs[user]) for user in prefs])
+    itemPrefs = recommendations.transformPrefs(prefs)
+    popularity = np.array([len(itemPrefs[item]) for item in itemPrefs], dtype=np.float64)
+    means = np.array([np.mean(list(itemPrefs[item].values())) for item in itemPrefs])
+
+    nusers = int(round(len(counts) * factor))
+    nitems = int(round(len(popularity) * factor))
+    weights = np.resize(popularity, nitems)
+    weights /= weights.sum()
+    itemMeans = np.resize(means, nitems)
+
+    result = {}
+    for user in range(nusers):
+        count = min(int(round(rng.choice(counts) * factor)), nitems)
+        items = rng.choice(nitems, count, replace=False, p=weights)
+        bias = rng.normal(scale=0.5)
+        ratings = np.clip(np.round(itemMeans[items] + bias + rng.normal(size=count)), 1, 5)
+        result[str(user)] = dict(('item%d' % item, float(rating))
+                                 for item, rating in zip(items, ratings))
+    return result
+
+
+def timeCalls(fn, calls):
+    """
+    依次执行fn(*args)，记录每次调用的耗时
+    :return: 延迟分位数与吞吐量
+    """
+    latencies = []
+    for args in calls:
+        start = time.time()
+        fn(*args)
+        latencies.append(time.time() - start)
+    latencies = np.array(latencies)
+    total = latencies.sum()
+    return {'calls': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'mean_ms': float(latencies.mean() * 1000),
+            'throughput_per_s': float(len(latencies) / total) if total > 0 else None}
+
+
+def runCase(name, prefs, backend, samples, seed):
+    """
+    运行一个测试项，只对被测函数本身计时
+    """
+    pearson, distance = BACKENDS[backend]
+    rng = random.Random(seed)
+    users = sorted(prefs)
+    picks = [rng.choice(users) for i in range(samples)]
+
+    if name == 'sim_pearson':
+        calls = [(prefs, user, rng.choice(users)) for user in picks]
+        # 向量化后端第一次调用时构建评分矩阵，不计入单次调用的延迟
+        pearson(prefs, users[0], users[-1])
+        return timeCalls(pearson, calls)
+    if name == 'topMatches':
+        pearson(prefs, users[0], users[-1])
+        return timeCalls(recommendations.topMatches, [(prefs, user, 10, pearson) for user in picks])
+    if name == 'annTopMatches':
+        pearson(prefs, users[0], users[-1])
+        index = ann.LSHIndex()
+        index.addAll(prefs)
+        result = timeCalls(index.topMatches, [(prefs, user, 10, pearson) for user in picks])
+        # 召回率和候选比例不计入延迟
+        result['recall_at_10'] = ann.recall(index, prefs, picks, 10, pearson)
+        result['candidate_fraction'] = float(np.mean([len(index.candidates(prefs, user)) for user in picks])) / len(prefs)
+        return result
+    if name == 'getRecommendations':
+        pearson(prefs, users[0], users[-1])
+        return timeCalls(recommendations.getRecommendations,
+                         [(prefs, user, pearson) for user in picks])
+    if name == 'calculateSimilarItems':
+        return timeCalls(recommendations.calculateSimilarItems, [(prefs, 50, distance)])
+    if name == 'getRecommendedItems':
+        itemMatch = recommendations.calculateSimilarItems(prefs, 50, simmatrix.sim_distance_matrix)
+        return timeCalls(recommendations.getRecommendedItems,
+                         [(prefs, itemMatch, user) for user in picks])
+    raise ValueError('unknown function %r' % name)
+
+
+def _child(queue, name, prefs, backend, samples, seed):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        result = runCase(name, prefs, backend, samples, seed)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak_rss_kb'] = after
+        result['peak_rss_growth_kb'] = after - before
+    except Exception as e:
+        result = {'error': '%s: %s' % (type(e).__name__, e)}
+    queue.put(result)
+
+
+def benchmark(name, prefs, backend='python', samples=100, seed=0):
+    """
+    在子进程中运行一个测试项，返回计时和峰值内存
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child, args=(queue, name, prefs, backend, samples, seed))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1])
+    parser.add_argument('--functions', nargs='+', default=FUNCTIONS, choices=FUNCTIONS)
+    parser.add_argument('--backend', nargs='+', default=['python'], choices=sorted(BACKENDS))
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON文件，默认输出到标准输出')
+    args = parser.parse_args(argv)
+
+    base = loadRatings().toPrefs()
+    report = {'python': platform.python_version(), 'numpy': np.__version__,
+              'seed': args.seed, 'samples': args.samples, 'results': []}
+    for scale in args.scales:
+        prefs = synthesize(base, scale, args.seed)
+        dataset = {'scale': scale, 'users': len(prefs),
+                   'items': len(recommendations.buildItemIndex(prefs)),
+                   'ratings': sum(len(prefs[user]) for user in prefs)}
+        for backend in args.backend:
+            for name in args.functions:
+                result = benchmark(name, prefs, backend, args.samples, args.seed)
+                result.update(dataset)
+                result.update({'function': name, 'backend': backend})
+                report['results'].append(result)
+                sys.stderr.write('%s\n' % json.dumps(result, sort_keys=True))
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    json.dump(report, out, indent=2, sort_keys=True)
+    out.write('\n')
+    if args.output:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
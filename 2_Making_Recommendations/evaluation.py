@@ -0,0 +1,244 @@
+# -*- coding:utf-8 -*-
+
+"""
+推荐算法的离线交叉验证。
+
+把u.data按用户（每个用户的评分随机分到k折）或按时间（按时间戳切块，用较早的
+评分训练、预测之后的评分）划分，对每个模型计算RMSE/MAE、覆盖率、
+precision@N/recall@N以及建模和查询耗时。每折的建模和按用户分块的预测都在
+进程池中执行，相同的seed得到相同的划分：
+
+    python evaluation.py --folds 5 --split user --models user:pearson item:distance
+
+模型写作“类型:相似度”，类型为user（getRecommendations）或item
+（calculateSimilarItems + getRecommendedItems），相似度为pearson或distance。
+"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+import numpy as np
+
+import recommendations
+from benchmark import BACKENDS
+from movielens import loadRatings
+
+
+def splitFolds(ratings, k=5, by='user', seed=0):
+    """
+    :param ratings: movielens.Ratings
+    :param k: 折数
+    :param by: 'user'时每个用户的评分随机均分到k折；
+               'time'时按时间戳切成k+1块，第f折用前f+1块训练、第f+1块测试
+    :param seed:
+    :return: [(训练集下标, 测试集下标), ...]
+    """
+    rng = np.random.RandomState(seed)
+    if by == 'user':
+        order = rng.permutation(len(ratings))
+        order = order[np.argsort(ratings.users[order], kind='mergesort')]
+        # 每个用户的评分在order中连续排列，按用户内的序号轮流分配到各折
+        users = ratings.users[order]
+        starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        offsets = rng.randint(k, size=users.max() + 1)
+        fold = np.empty(len(order), dtype=int)
+        fold[order] = (rank + offsets[users]) % k
+        return [(np.flatnonzero(fold != f), np.flatnonzero(fold == f)) for f in range(k)]
+    if by == 'time':
+        order = np.argsort(ratings.timestamps, kind='mergesort')
+        blocks = np.array_split(order, k + 1)
+        return [(np.concatenate(blocks[:f + 1]), blocks[f + 1]) for f in range(k)]
+    raise ValueError('unknown split %r' % by)
+
+
+def toPrefs(ratings, index):
+    """
+    用ratings中的部分评分构建prefs，电影以整数编号为键
+    """
+    prefs = {}
+    for user, item, rating in zip(ratings.users[index].tolist(), ratings.items[index].tolist(),
+                                  ratings.ratings[index].tolist()):
+        prefs.setdefault(str(user), {})
+        prefs[str(user)][item] = rating
+    return prefs
+
+
+# 子进程中只读共享的数据，由_init在进程启动时设置
+_shared = {}
+
+
+def _init(folds, models, itemMatches, n, threshold):
+    _shared.update(folds=folds, models=models, itemMatches=itemMatches, n=n, threshold=threshold)
+
+
+def _similarity(model):
+    kind, name, backend = model
+    pearson, distance = BACKENDS[backend]
+    return pearson if name == 'pearson' else distance
+
+
+def _build(task):
+    """
+    为一折训练一个基于物品的模型
+    """
+    f, m = task
+    train = _shared['folds'][f][0]
+    model = _shared['models'][m]
+    start = time.time()
+    itemMatch = recommendations.calculateSimilarItems(train, 50, _similarity(model))
+    return task, itemMatch, time.time() - start
+
+
+def _predict(task):
+    """
+    对一折中的一组用户做预测，返回误差与命中情况的累计值
+    """
+    f, m, users = task
+    train, test = _shared['folds'][f]
+    model = _shared['models'][m]
+    n, threshold = _shared['n'], _shared['threshold']
+    similarity = _similarity(model)
+    totals = dict(sqerr=0.0, abserr=0.0, predicted=0, rated=0, precision=0.0, recall=0.0,
+                  ranked=0, latencies=[])
+    for user in users:
+        if user not in train:
+            continue
+        start = time.time()
+        if model[0] == 'user':
+            rankings = recommendations.getRecommendations(train, user, similarity)
+        else:
+            rankings = recommendations.getRecommendedItems(train, _shared['itemMatches'][(f, m)], user)
+        totals['latencies'].append(time.time() - start)
+
+        predictions = dict((item, score) for score, item in rankings)
+        for item, rating in test[user].items():
+            totals['rated'] += 1
+            if item in predictions:
+                totals['predicted'] += 1
+                totals['sqerr'] += (predictions[item] - rating) ** 2
+                totals['abserr'] += abs(predictions[item] - rating)
+        relevant = set(item for item, rating in test[user].items() if rating >= threshold)
+        if relevant:
+            top = set(item for score, item in rankings[0 : n])
+            hits = len(top & relevant)
+            totals['precision'] += float(hits) / n
+            totals['recall'] += float(hits) / len(relevant)
+            totals['ranked'] += 1
+    return f, m, totals
+
+
+def evaluate(ratings, models, k=5, by='user', seed=0, processes=None, n=10, threshold=4.0,
+             maxUsers=None, chunksize=50):
+    """
+    :param ratings: movielens.Ratings
+    :param models: [(类型, 相似度, 后端), ...]，例如('item', 'distance', 'matrix')
+    :param k: 折数
+    :param by: 'user'或'time'
+    :param seed:
+    :param processes: 进程数，None表示使用全部CPU
+    :param n: precision@N/recall@N中的N
+    :param threshold: 测试集中评分不低于该值的物品视为用户喜欢的物品
+    :param maxUsers: 每折最多评估的用户数（按seed抽样），None表示全部
+    :param chunksize: 每个预测任务包含的用户数
+    :return: 每个模型每一折的指标
+    """
+    folds = []
+    rng = np.random.RandomState(seed)
+    for trainIndex, testIndex in splitFolds(ratings, k, by, seed):
+        folds.append((toPrefs(ratings, trainIndex), toPrefs(ratings, testIndex)))
+
+    buildTasks = [(f, m) for f in range(k) for m in range(len(models)) if models[m][0] == 'item']
+    pool = multiprocessing.Pool(processes, _init, (folds, models, {}, n, threshold))
+    try:
+        built = pool.map(_build, buildTasks)
+    finally:
+        pool.close()
+        pool.join()
+    itemMatches = dict((task, itemMatch) for task, itemMatch, seconds in built)
+    buildTimes = dict((task, seconds) for task, itemMatch, seconds in built)
+
+    predictTasks = []
+    for f in range(k):
+        users = sorted(folds[f][1])
+        if maxUsers is not None and len(users) > maxUsers:
+            users = [users[i] for i in sorted(rng.choice(len(users), maxUsers, replace=False))]
+        for m in range(len(models)):
+            for start in range(0, len(users), chunksize):
+                predictTasks.append((f, m, users[start : start + chunksize]))
+    pool = multiprocessing.Pool(processes, _init, (folds, models, itemMatches, n, threshold))
+    try:
+        partials = pool.map(_predict, predictTasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    merged = {}
+    for f, m, totals in partials:
+        result = merged.setdefault((f, m), dict(sqerr=0.0, abserr=0.0, predicted=0, rated=0,
+                                                precision=0.0, recall=0.0, ranked=0, latencies=[]))
+        for key, value in totals.items():
+            result[key] += value
+
+    report = []
+    for (f, m), totals in sorted(merged.items()):
+        predicted = max(totals['predicted'], 1)
+        ranked = max(totals['ranked'], 1)
+        latencies = np.array(totals['latencies'] or [0.0])
+        report.append({
+            'model': '%s:%s:%s' % models[m], 'fold': f,
+            'rmse': float(np.sqrt(totals['sqerr'] / predicted)),
+            'mae': totals['abserr'] / predicted,
+            'coverage': float(totals['predicted']) / max(totals['rated'], 1),
+            'precision@%d' % n: totals['precision'] / ranked,
+            'recall@%d' % n: totals['recall'] / ranked,
+            'build_s': buildTimes.get((f, m), 0.0),
+            'query_p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'query_p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'users': len(totals['latencies'])})
+    return report
+
+
+def summarize(report):
+    """
+    对每个模型的各折指标取平均
+    """
+    byModel = {}
+    for row in report:
+        byModel.setdefault(row['model'], []).append(row)
+    summary = {}
+    for model, rows in byModel.items():
+        keys = [key for key in rows[0] if key not in ('model', 'fold')]
+        summary[model] = dict((key, float(np.mean([row[key] for row in rows]))) for key in keys)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--split', choices=['user', 'time'], default='user')
+    parser.add_argument('--models', nargs='+', default=['user:pearson', 'item:distance'])
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='matrix')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--threshold', type=float, default=4.0)
+    parser.add_argument('--max-users', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON文件，默认输出到标准输出')
+    args = parser.parse_args(argv)
+
+    models = [tuple(model.split(':')) + (args.backend,) for model in args.models]
+    report = evaluate(loadRatings(), models, args.folds, args.split, args.seed, args.processes,
+                      args.n, args.threshold, args.max_users)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    json.dump({'folds': report, 'summary': summarize(report), 'split': args.split,
+               'seed': args.seed}, out, indent=2, sort_keys=True)
+    out.write('\n')
+    if args.output:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# -*- coding:utf-8 -*-
+
+"""
+隐语义模型（矩阵分解）推荐。
+
+把评分近似为 全局平均分 + 用户因子·物品因子，用交替最小二乘（ALS）或小批量
+随机梯度下降（SGD）在prefs（或loadMovieLens的结果）上训练。
+推荐时只需要把用户因子与物品因子矩阵做一次乘法，开销与近邻数量无关：
+
+    model = MatrixFactorization(factors=20, processes=4)
+    model.fit(prefs)
+    model.recommend('87', n=10)
+"""
+
+import multiprocessing
+import numpy as np
+from scipy import sparse
+from simmatrix import RatingMatrix, topScores
+
+
+def _solveBlock(args):
+    """
+    ALS中的一个分块：固定另一侧的因子矩阵Y，为一组行求解正则化最小二乘
+    """
+    Y, indptr, indices, values, regularization = args
+    k = Y.shape[1]
+    X = np.zeros((len(indptr) - 1, k))
+    for row in range(len(indptr) - 1):
+        cols = indices[indptr[row] : indptr[row + 1]]
+        if len(cols) == 0:
+            continue
+        Yc = Y[cols]
+        A = np.dot(Yc.T, Yc) + regularization * len(cols) * np.eye(k)
+        b = np.dot(Yc.T, values[indptr[row] : indptr[row + 1]])
+        X[row] = np.linalg.solve(A, b)
+    return X
+
+
+class MatrixFactorization:
+    def __init__(self, factors=20, regularization=0.1, iterations=15, method='als',
+                 learningRate=0.01, batchsize=1024, processes=1, seed=0):
+        """
+        :param factors: 隐因子个数
+        :param regularization: 正则化系数
+        :param iterations: ALS的轮数或SGD的遍数
+        :param method: 'als'或'sgd'
+        :param learningRate: SGD的学习率
+        :param batchsize: SGD每个小批量的评分数
+        :param processes: ALS求解时使用的进程数，None表示使用全部CPU
+        :param seed: 随机种子
+        """
+        self.factors = factors
+        self.regularization = regularization
+        self.iterations = iterations
+        self.method = method
+        self.learningRate = learningRate
+        self.batchsize = batchsize
+        self.processes = processes
+        self.seed = seed
+
+    def fit(self, prefs):
+        """
+        :param prefs: 数据集（用户：物品）
+        :return: self
+        """
+        m = RatingMatrix(prefs)
+        self.users, self.userIndex = m.keys, m.index
+        self.items, self.itemIndex = m.items, m.itemIndex
+        self.rated = m.M
+        self.mean = m.R.data.mean() if m.R.nnz else 0.0
+        residual = sparse.csr_matrix((m.R.data - self.mean, m.R.indices, m.R.indptr), shape=m.R.shape)
+
+        rng = np.random.RandomState(self.seed)
+        self.P = rng.normal(scale=0.1, size=(len(self.users), self.factors))
+        self.Q = rng.normal(scale=0.1, size=(len(self.items), self.factors))
+        if self.method == 'als':
+            self._fitALS(residual)
+        elif self.method == 'sgd':
+            self._fitSGD(residual.tocoo())
+        else:
+            raise ValueError('unknown method %r' % self.method)
+        return self
+
+    def _blocks(self, R, Y, count):
+        """
+        把R的行切成count块，每块附带求解需要的数据
+        """
+        bounds = np.linspace(0, R.shape[0], count + 1).astype(int)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            part = R[start : end]
+            yield (Y, part.indptr, part.indices, part.data, self.regularization)
+
+    def _fitALS(self, R):
+        Rt = R.T.tocsr()
+        processes = self.processes or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes) if processes > 1 else None
+        solve = pool.map if pool else map
+        try:
+            for it in range(self.iterations):
+                self.P = np.vstack(solve(_solveBlock, list(self._blocks(R, self.Q, processes))))
+                self.Q = np.vstack(solve(_solveBlock, list(self._blocks(Rt, self.P, processes))))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def _fitSGD(self, R):
+        rng = np.random.RandomState(self.seed)
+        users, items, values = R.row, R.col, R.data
+        for it in range(self.iterations):
+            order = rng.permutation(len(values))
+            for start in range(0, len(order), self.batchsize):
+                batch = order[start : start + self.batchsize]
+                u, i = users[batch], items[batch]
+                Pu, Qi = self.P[u], self.Q[i]
+                err = values[batch] - np.sum(Pu * Qi, axis=1)
+                # 同一批中重复出现的用户/物品，梯度需要累加
+                np.add.at(self.P, u, self.learningRate * (err[:, None] * Qi - self.regularization * Pu))
+                np.add.at(self.Q, i, self.learningRate * (err[:, None] * Pu - self.regularization * Qi))
+
+    def predict(self, user, item):
+        """
+        :return: user对item的预测评分
+        """
+        return float(self.mean + np.dot(self.P[self.userIndex[user]], self.Q[self.itemIndex[item]]))
+
+    def recommend(self, user, n=10):
+        """
+        为user推荐尚未评价的物品
+        :return: [(预测评分, item), ...]
+        """
+        u = self.userIndex[user]
+        scores = self.mean + np.dot(self.Q, self.P[u])
+        scores[self.rated[u].indices] = -np.inf
+        return topScores(scores, self.items, n)
+
+    def rmse(self, prefs):
+        """
+        在prefs中模型认识的用户和物品上计算均方根误差
+        """
+        errors = [rating - self.predict(user, item)
+                  for user in prefs if user in self.userIndex
+                  for item, rating in prefs[user].items() if item in self.itemIndex]
+        return float(np.sqrt(np.mean(np.square(errors)))) if errors else 0.0
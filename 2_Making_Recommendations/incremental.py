@@ -0,0 +1,193 @@
+# -*- coding:utf-8 -*-
+
+"""
+增量维护的物品相似度模型。
+
+保存每一对有共同评价用户的物品的充分统计量（共同评价数、评分和、评分平方和、
+评分乘积之和），内存与这样的物品对数成正比，新增物品不需要扩容任何数组。新增或修改一条评分时只更新受影响的物品对以及它们的topn列表，
+不需要重新执行O(物品数²)的calculateSimilarItems。
+
+模型本身可以当作itemMatch直接传给getRecommendedItems：
+    model = ItemSimilarityModel(prefs, n=50)
+    model.add_rating('87', 'Toy Story (1995)', 4.0)
+    getRecommendedItems(model.prefs, model, '87')
+"""
+
+import heapq
+import numpy as np
+from simmatrix import RatingMatrix, similarityFromSums, topScores
+
+
+class ItemSimilarityModel:
+    def __init__(self, prefs=None, n=10, metric='distance'):
+        """
+        :param prefs: 初始数据集（用户：物品），为None时从空模型开始
+        :param n: 每个物品保留的相近物品数
+        :param metric: 'distance'（与calculateSimilarItems相同）或'pearson'
+        """
+        self.n = n
+        self.metric = metric
+        self.prefs = {}
+        self.items = []
+        self.itemIndex = {}
+        self.top = {}
+        # 统计量按物品稀疏保存，只包含有共同评价用户的物品对。
+        # cols[i]: 与物品i有共同评价用户的物品下标（升序）
+        # vals[i]: 对应的len(cols[i])×6数组，每一行依次为同时评价过i和j的用户数、
+        #          这些用户对i的评分和、对j的评分和、对i的评分平方和、对j的评分平方和、
+        #          评分乘积之和
+        self.cols = []
+        self.vals = []
+        if prefs:
+            self._build(prefs)
+
+    def _build(self, prefs):
+        """
+        用稀疏矩阵乘法一次性算出所有物品对的统计量，不生成稠密的物品×物品数组
+        """
+        m = RatingMatrix(prefs)
+        for person in prefs:
+            self.prefs[person] = dict(prefs[person])
+        self.items = list(m.items)
+        self.itemIndex = dict(m.itemIndex)
+        N = (m.MT * m.M).tocsr()
+        N.sort_indices()
+        S = m.RT * m.M
+        Q = m.R2T * m.M
+        columns = [N.data, _alignTo(S, N), _alignTo(S.T, N), _alignTo(Q, N), _alignTo(Q.T, N),
+                   _alignTo(m.RT * m.R, N)]
+        stats = np.column_stack(columns)
+        for i in range(len(self.items)):
+            lo, hi = N.indptr[i], N.indptr[i + 1]
+            keep = N.indices[lo:hi] != i
+            self.cols.append(N.indices[lo:hi][keep].astype(np.intp))
+            self.vals.append(stats[lo:hi][keep])
+        for i, item in enumerate(self.items):
+            self.top[item] = topScores(self._scores(i), self.items, self.n)
+
+    def _index(self, item):
+        if item not in self.itemIndex:
+            self.itemIndex[item] = len(self.items)
+            self.items.append(item)
+            self.cols.append(np.zeros(0, dtype=np.intp))
+            self.vals.append(np.zeros((0, 6)))
+            self.top[item] = []
+        return self.itemIndex[item]
+
+    def _slots(self, i, J):
+        """
+        物品i的统计量中物品J对应的行号，还没有的物品对插入一行0
+        """
+        J = np.asarray(J, dtype=np.intp)
+        cols = self.cols[i]
+        missing = np.setdiff1d(J, cols)
+        if len(missing):
+            merged = np.union1d(cols, missing)
+            vals = np.zeros((len(merged), 6))
+            vals[np.searchsorted(merged, cols)] = self.vals[i]
+            self.cols[i], self.vals[i] = merged, vals
+        return np.searchsorted(self.cols[i], J)
+
+    def _scores(self, i):
+        """
+        物品i与所有物品的相似度，自身和没有共同评价用户的物品为-inf
+        """
+        sim = np.empty(len(self.items))
+        sim.fill(-np.inf)
+        V = self.vals[i]
+        sim[self.cols[i]] = similarityFromSums(V[:, 0], V[:, 1], V[:, 2], V[:, 3], V[:, 4], V[:, 5],
+                                               self.metric)
+        sim[self.cols[i][V[:, 0] == 0]] = -np.inf
+        return sim
+
+    def _score(self, i, j):
+        row = self.vals[i][self._slots(i, [j])[0]]
+        return float(similarityFromSums(row[0], row[1], row[2], row[3], row[4], row[5], self.metric))
+
+    def add_rating(self, user, item, rating):
+        """
+        新增一条评分，user已经评价过item时等同于update_rating
+        """
+        if item in self.prefs.get(user, {}):
+            return self.update_rating(user, item, rating)
+        i = self._index(item)
+        others = self.prefs.setdefault(user, {})
+        J = np.array([self.itemIndex[other] for other in others], dtype=np.intp)
+        rj = np.array(list(others.values()), dtype=np.float64)
+        pos = self._slots(i, J)
+        V = self.vals[i]
+        V[pos] += np.column_stack([np.ones(len(J)), np.repeat(rating, len(J)), rj,
+                                   np.repeat(rating * rating, len(J)), rj * rj, rating * rj])
+        for j, r in zip(J, rj):
+            p = self._slots(j, [i])[0]
+            self.vals[j][p] += [1, r, rating, r * r, rating * rating, rating * r]
+        others[item] = rating
+        self._refresh(i, J)
+
+    def update_rating(self, user, item, rating):
+        """
+        修改user对item的评分，user尚未评价过item时等同于add_rating
+        """
+        if item not in self.prefs.get(user, {}):
+            return self.add_rating(user, item, rating)
+        i = self.itemIndex[item]
+        old = self.prefs[user][item]
+        others = [other for other in self.prefs[user] if other != item]
+        J = np.array([self.itemIndex[other] for other in others], dtype=np.intp)
+        rj = np.array([self.prefs[user][other] for other in others], dtype=np.float64)
+        # 共同评价数不变，只需修正与i的评分有关的累加项
+        pos = self._slots(i, J)
+        V = self.vals[i]
+        V[pos, 1] += rating - old
+        V[pos, 3] += rating * rating - old * old
+        V[pos, 5] += (rating - old) * rj
+        for j, r in zip(J, rj):
+            p = self._slots(j, [i])[0]
+            self.vals[j][p] += [0, 0, rating - old, 0, rating * rating - old * old, (rating - old) * r]
+        self.prefs[user][item] = rating
+        self._refresh(i, J)
+
+    def _refresh(self, i, J):
+        """
+        重新计算物品i的topn列表，并把(i, j)的新分数合并进每个j的列表
+        """
+        self.top[self.items[i]] = topScores(self._scores(i), self.items, self.n)
+        item = self.items[i]
+        for j in J:
+            other = self.items[j]
+            current = self.top[other]
+            if any(item2 == item for _, item2 in current):
+                # i原来就在j的列表中，分数下降时可能被其他物品取代，需要重新扫描
+                self.top[other] = topScores(self._scores(j), self.items, self.n)
+                continue
+            entry = (self._score(j, i), item)
+            if len(current) < self.n or entry > current[-1]:
+                self.top[other] = heapq.nlargest(self.n, current + [entry])
+
+    def __getitem__(self, item):
+        return self.top[item]
+
+    def __contains__(self, item):
+        return item in self.top
+
+    def __iter__(self):
+        return iter(self.top)
+
+    def __len__(self):
+        return len(self.top)
+
+    def keys(self):
+        return self.top.keys()
+
+
+def _alignTo(X, N):
+    """
+    按N的稀疏结构取出X中对应位置的值。X与N的结构通常相同，
+    但评分为0时X的乘积中可能缺少这些位置
+    """
+    X = X.tocsr()
+    X.sort_indices()
+    if np.array_equal(X.indptr, N.indptr) and np.array_equal(X.indices, N.indices):
+        return X.data
+    rows = np.repeat(np.arange(N.shape[0]), np.diff(N.indptr))
+    return np.asarray(X[rows, N.indices]).ravel()
@@ -0,0 +1,179 @@
+# -*- coding:utf-8 -*-
+
+"""
+把calculateSimilarItems的结果保存为紧凑的二进制文件，并以内存映射的方式载入。
+
+文件布局（小端序）：
+    文件头      magic 'PCIN'、版本号、物品数、每个物品的相近物品数width、名称区字节数、
+                名称类型（0为字节串，1为整数编号，2为UTF-8文本），补齐到32字节
+    名称偏移表  int64[物品数 + 1]，第i个物品的名称为名称区[off[i] : off[i + 1]]
+    名称区      物品名称（整数编号保存为十进制字符串），补齐到8字节
+    相近物品    int32[物品数, width]，为物品的整数编号，不足width的部分填-1
+    相似度      float32[物品数, width]
+
+多个服务进程载入同一个文件时共享同一份页面缓存，载入只需要读取名称表：
+    saveItemMatch(calculateSimilarItems(prefs, 50), 'itemsim.bin')
+    itemMatch = loadItemMatch('itemsim.bin')
+    getRecommendedItems(prefs, itemMatch, '87')
+"""
+
+import os
+import struct
+import tempfile
+import numpy as np
+
+MAGIC = 'PCIN'
+VERSION = 2
+HEADER = struct.Struct('<4sIIIQI4x')
+# 版本1的文件头没有名称类型，名称总是字节串
+HEADER_V1 = struct.Struct('<4sIIIQ')
+BYTES, INTEGERS, TEXT = 0, 1, 2
+
+
+def _keyType(names):
+    if names and all(isinstance(name, (int, long)) for name in names):
+        return INTEGERS
+    if any(isinstance(name, (int, long)) for name in names):
+        raise ValueError('item names must be all integers or all strings')
+    if any(isinstance(name, unicode) for name in names):
+        return TEXT
+    return BYTES
+
+
+def _decode(name, keyType):
+    if keyType == INTEGERS:
+        return int(name)
+    if keyType == TEXT:
+        return name.decode('utf-8')
+    return name
+
+
+def _align(size, alignment=8):
+    return (size + alignment - 1) // alignment * alignment
+
+
+def saveItemMatch(itemMatch, filename, width=None):
+    """
+    保存物品相似度字典
+    :param itemMatch: {item: [(相似度, item2), ...]}
+    :param filename:
+    :param width: 每个物品最多保存的相近物品数，默认为最长列表的长度
+    :return:
+    """
+    names = list(itemMatch)
+    index = dict((item, i) for i, item in enumerate(names))
+    # 只出现在相近物品中的物品也需要编号
+    for item in names[:]:
+        for _, item2 in itemMatch[item]:
+            if item2 not in index:
+                index[item2] = len(names)
+                names.append(item2)
+    if width is None:
+        width = max([len(scores) for scores in itemMatch.values()] or [0])
+
+    neighbours = np.full((len(names), width), -1, dtype=np.int32)
+    scores = np.zeros((len(names), width), dtype=np.float32)
+    for item, matches in itemMatch.items():
+        i = index[item]
+        for k, (score, item2) in enumerate(matches[0 : width]):
+            neighbours[i, k] = index[item2]
+            scores[i, k] = score
+
+    keyType = _keyType(names)
+    encoded = [name.encode('utf-8') if isinstance(name, unicode) else str(name) for name in names]
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(name) for name in encoded])
+    blob = ''.join(encoded)
+
+    out = open(filename, 'wb')
+    try:
+        out.write(HEADER.pack(MAGIC, VERSION, len(names), width, len(blob), keyType))
+        out.write(offsets.astype('<i8').tobytes())
+        out.write(blob + '\0' * (_align(len(blob)) - len(blob)))
+        out.write(neighbours.astype('<i4').tobytes())
+        out.write(scores.astype('<f4').tobytes())
+    finally:
+        out.close()
+
+
+class ItemNeighbours:
+    def __init__(self, filename):
+        """
+        以只读方式内存映射saveItemMatch保存的文件，用法与itemMatch字典相同
+        :param filename:
+        """
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+        magic, version = struct.unpack('<4sI', self.data[:8].tobytes())
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError('%s is not an item neighbour file' % filename)
+        if version == 1:
+            magic, version, count, width, blobsize = HEADER_V1.unpack(self.data[:HEADER_V1.size].tobytes())
+            keyType, start = BYTES, HEADER_V1.size
+        else:
+            magic, version, count, width, blobsize, keyType = HEADER.unpack(self.data[:HEADER.size].tobytes())
+            start = HEADER.size
+        self.width = width
+
+        offsets = self.data[start : start + 8 * (count + 1)].view('<i8')
+        start += 8 * (count + 1)
+        blob = self.data[start : start + blobsize].tobytes()
+        start += _align(blobsize)
+        self.neighbours = self.data[start : start + 4 * count * width].view('<i4').reshape(count, width)
+        start += 4 * count * width
+        self.scores = self.data[start : start + 4 * count * width].view('<f4').reshape(count, width)
+
+        # 按保存时的类型还原名称，整数编号和unicode名称才能与prefs中的键对应
+        self.names = [_decode(blob[offsets[i] : offsets[i + 1]], keyType) for i in range(count)]
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+
+    def __getitem__(self, item):
+        i = self.index[item]
+        return [(float(score), self.names[j])
+                for j, score in zip(self.neighbours[i], self.scores[i]) if j >= 0]
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def get(self, item, default=None):
+        if item in self.index:
+            return self[item]
+        return default
+
+
+def loadItemMatch(filename):
+    """
+    内存映射载入物品相似度文件
+    :param filename:
+    :return: 只读的ItemNeighbours
+    """
+    return ItemNeighbours(filename)
+
+
+if __name__ == '__main__':
+    # 整数编号和非ASCII的unicode名称保存后再载入，键的类型和值都应保持不变
+    for itemMatch in ({1: [(0.5, 2)], 2: [(0.5, 1), (0.25, 3)], 3: []},
+                      {u'Caf\xe9': [(0.9, u'Na\xefve')], u'Na\xefve': [(0.9, u'Caf\xe9')]},
+                      {'Toy Story (1995)': [(0.1, 'Heat (1995)')], 'Heat (1995)': []}):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            saveItemMatch(itemMatch, filename)
+            loaded = loadItemMatch(filename)
+            assert sorted((type(name), name) for name in loaded) == \
+                sorted((type(name), name) for name in itemMatch)
+            for item in itemMatch:
+                assert loaded[item] == [(float(np.float32(score)), item2) for score, item2 in itemMatch[item]]
+                assert all(type(item2) is type(item) for score, item2 in loaded[item])
+            del loaded
+        finally:
+            os.remove(filename)
+    print 'round trip ok'
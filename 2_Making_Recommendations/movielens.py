@@ -0,0 +1,129 @@
+# -*- coding:utf-8 -*-
+
+"""
+列式的MovieLens载入器。
+
+u.data被解析为整数的用户/电影编号、评分、时间戳数组，电影名称只载入一次。
+解析结果写入u.data旁边的二进制缓存，缓存以源文件的修改时间和大小为键，
+源文件不变时再次载入直接读取缓存，不需要重新解析。
+
+    ratings = loadRatings()
+    prefs = ratings.toPrefs()     # 与loadMovieLens相同的嵌套字典
+    R = ratings.toMatrix()        # 用户×电影的稀疏矩阵
+"""
+
+import os
+import zipfile
+import numpy as np
+from scipy import sparse
+
+DATADIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_VERSION = 1
+
+
+class Ratings:
+    def __init__(self, users, items, ratings, timestamps, titles):
+        """
+        :param users: 用户编号数组
+        :param items: 电影编号数组
+        :param ratings: 评分数组
+        :param timestamps: 时间戳数组
+        :param titles: 按电影编号索引的名称列表
+        """
+        self.users = users
+        self.items = items
+        self.ratings = ratings
+        self.timestamps = timestamps
+        self.titles = titles
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def toPrefs(self, titles=True):
+        """
+        转换为loadMovieLens返回的嵌套字典：{用户编号字符串: {电影名称: 评分}}
+        :param titles: 为False时以整数电影编号作为键
+        :return:
+        """
+        names = self.titles if titles else range(len(self.titles))
+        prefs = {}
+        for user, item, rating in zip(self.users.tolist(), self.items.tolist(),
+                                      self.ratings.tolist()):
+            prefs.setdefault(str(user), {})
+            prefs[str(user)][names[item]] = rating
+        return prefs
+
+    def toMatrix(self):
+        """
+        :return: csr格式的稀疏矩阵，行号为用户编号，列号为电影编号
+        """
+        shape = (self.users.max() + 1, len(self.titles))
+        return sparse.csr_matrix((self.ratings, (self.users, self.items)), shape=shape)
+
+
+def _sourceKey(*filenames):
+    key = []
+    for filename in filenames:
+        st = os.stat(filename)
+        key.extend([st.st_mtime, st.st_size])
+    return np.array([CACHE_VERSION] + key, dtype=np.float64)
+
+
+def _parse(datafile, itemfile):
+    titles = ['']
+    for line in open(itemfile):
+        (id, title) = line.split('|')[0:2]
+        id = int(id)
+        if id >= len(titles):
+            titles.extend([''] * (id + 1 - len(titles)))
+        titles[id] = title
+    # 一次性把整个文件解析为数字，每行依次为用户、电影、评分、时间戳
+    columns = np.fromstring(open(datafile, 'rb').read(), dtype=np.float64, sep=' ').reshape(-1, 4)
+    return Ratings(columns[:, 0].astype(np.int32), columns[:, 1].astype(np.int32),
+                   columns[:, 2].astype(np.float32), columns[:, 3].astype(np.int64), titles)
+
+
+def loadRatings(path=DATADIR, datafile='u.data', itemfile='u.item', cache=True):
+    """
+    载入MovieLens评分数据
+    :param path: 数据所在目录，默认为本模块所在目录
+    :param datafile:
+    :param itemfile:
+    :param cache: 是否读写二进制缓存
+    :return: Ratings
+    """
+    datafile = os.path.join(path, datafile)
+    itemfile = os.path.join(path, itemfile)
+    cachefile = datafile + '.cache.npz'
+    key = _sourceKey(datafile, itemfile)
+
+    if cache and os.path.exists(cachefile):
+        try:
+            stored = np.load(cachefile)
+            try:
+                if np.array_equal(stored['key'], key):
+                    return Ratings(stored['users'], stored['items'], stored['ratings'],
+                                   stored['timestamps'], stored['titles'].tolist())
+            finally:
+                stored.close()
+        except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+            # 缓存损坏或格式不对时当作没有缓存，重新解析
+            pass
+
+    ratings = _parse(datafile, itemfile)
+    if cache:
+        try:
+            # 先写临时文件再改名，其他进程不会读到写了一半的缓存
+            tmp = '%s.%d.tmp' % (cachefile, os.getpid())
+            out = open(tmp, 'wb')
+            try:
+                np.savez(out, key=key, users=ratings.users, items=ratings.items,
+                         ratings=ratings.ratings, timestamps=ratings.timestamps,
+                         titles=np.array(ratings.titles, dtype=np.string_))
+            finally:
+                out.close()
+            os.rename(tmp, cachefile)
+        except (IOError, OSError):
+            # 数据目录不可写时只是不使用缓存
+            pass
+    return ratings
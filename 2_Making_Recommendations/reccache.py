@@ -0,0 +1,176 @@
+# -*- coding:utf-8 -*-
+
+"""
+带评分感知失效机制的推荐结果缓存。
+
+缓存topMatches、getRecommendations和getRecommendedItems的结果，按LRU淘汰，
+可选TTL过期。评分必须通过setRating修改，这样只有真正受影响的条目才会失效：
+
+- 基于用户的结果（topMatches/getRecommendations）依赖于person本身、与person
+  有共同评价物品的用户，以及person评价过的物品（有人新评价这些物品时会产生
+  新的近邻）；
+- 基于物品的结果依赖于user本身；如果itemMatch是随评分增量更新的模型
+  （见incremental.ItemSimilarityModel），还依赖于user评价过的物品的近邻列表。
+
+    cache = RecommendationCache(prefs, maxsize=10000, ttl=3600)
+    cache.getRecommendations('87', n=10)
+    cache.setRating('87', 'Toy Story (1995)', 4.0)
+    cache.stats()
+"""
+
+import time
+from collections import OrderedDict
+from recommendations import (sim_pearson, topMatches, getRecommendations,
+                             getRecommendedItems, buildItemIndex, coRatedUsers)
+
+
+# 按对象身份比较的键。itemMatch是不能作为键的字典，只用id(itemMatch)时对象被回收后
+# id可能被新的对象重用；键中保留对象的引用，条目存在期间id就不会被重用
+class _Identity:
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __hash__(self):
+        return id(self.obj)
+
+    def __eq__(self, other):
+        return isinstance(other, _Identity) and self.obj is other.obj
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class RecommendationCache:
+    def __init__(self, prefs, maxsize=1024, ttl=None, itemModel=None, timer=time.time):
+        """
+        :param prefs: 数据集，由缓存负责修改
+        :param maxsize: 最多缓存的条目数
+        :param ttl: 条目的有效秒数，None表示不过期
+        :param itemModel: 随评分增量更新的物品相似度模型，setRating时同步更新
+        :param timer: 返回当前时间的函数
+        """
+        self.prefs = prefs
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.itemModel = itemModel
+        self.timer = timer
+        self.index = buildItemIndex(prefs)
+        # key -> (过期时间, 结果, 依赖的用户, 依赖的物品, 依赖的近邻列表)
+        self.entries = OrderedDict()
+        self.byUser = {}
+        self.byItem = {}
+        self.byNeighbours = {}
+        self.backends = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] is not None and entry[0] <= self.timer():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        # 移到末尾，表示最近使用过
+        del self.entries[key]
+        self.entries[key] = entry
+        self.hits += 1
+        return list(entry[1])
+
+    def _put(self, key, value, users=(), items=(), neighbours=()):
+        if key in self.entries:
+            self._remove(key)
+        expires = None if self.ttl is None else self.timer() + self.ttl
+        self.entries[key] = (expires, value, set(users), set(items), set(neighbours))
+        for deps, keys in ((users, self.byUser), (items, self.byItem),
+                           (neighbours, self.byNeighbours)):
+            for dep in deps:
+                keys.setdefault(dep, set())
+                keys[dep].add(key)
+        while len(self.entries) > self.maxsize:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+        return list(value)
+
+    def _remove(self, key):
+        expires, value, users, items, neighbours = self.entries.pop(key)
+        for deps, keys in ((users, self.byUser), (items, self.byItem),
+                           (neighbours, self.byNeighbours)):
+            for dep in deps:
+                keys[dep].discard(key)
+                if not keys[dep]:
+                    del keys[dep]
+
+    def _userDeps(self, person):
+        return [person] + coRatedUsers(self.prefs, self.index, person), list(self.prefs[person])
+
+    def topMatches(self, person, n=5, similarity=sim_pearson):
+        key = ('topMatches', person, n, similarity)
+        value = self._get(key)
+        if value is None:
+            self._track(similarity)
+            users, items = self._userDeps(person)
+            value = self._put(key, topMatches(self.prefs, person, n, similarity), users, items)
+        return value
+
+    def getRecommendations(self, person, similarity=sim_pearson, n=None):
+        key = ('getRecommendations', person, similarity, n)
+        value = self._get(key)
+        if value is None:
+            self._track(similarity)
+            users, items = self._userDeps(person)
+            rankings = getRecommendations(self.prefs, person, similarity, index=self.index, n=n)
+            value = self._put(key, rankings, users, items)
+        return value
+
+    def getRecommendedItems(self, itemMatch, user, n=None):
+        key = ('getRecommendedItems', _Identity(itemMatch), user, n)
+        value = self._get(key)
+        if value is None:
+            neighbours = list(self.prefs[user]) if itemMatch is self.itemModel else []
+            rankings = getRecommendedItems(self.prefs, itemMatch, user, n=n)
+            value = self._put(key, rankings, [user], neighbours=neighbours)
+        return value
+
+    def _track(self, similarity):
+        # 向量化后端按prefs对象缓存评分矩阵，评分变化后需要重置
+        if hasattr(similarity, 'reset'):
+            self.backends.add(similarity)
+
+    def setRating(self, user, item, rating):
+        """
+        新增或修改一条评分，并使受影响的缓存条目失效
+        """
+        affected = set(self.byUser.get(user, ())) | self.byItem.get(item, set())
+        self.prefs.setdefault(user, {})
+        self.prefs[user][item] = rating
+        self.index.setdefault(item, set())
+        self.index[item].add(user)
+        if self.itemModel is not None:
+            self.itemModel.update_rating(user, item, rating)
+            # item以及user评价过的其他物品之间的相似度都变了
+            for changed in self.prefs[user]:
+                affected |= self.byNeighbours.get(changed, set())
+        for backend in self.backends:
+            backend.reset()
+        for key in affected:
+            self._remove(key)
+        self.invalidations += len(affected)
+
+    def clear(self):
+        for key in list(self.entries):
+            self._remove(key)
+
+    def stats(self):
+        """
+        :return: 命中、未命中、淘汰、过期和失效次数以及当前条目数
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'expirations': self.expirations, 'invalidations': self.invalidations,
+                'size': len(self.entries)}
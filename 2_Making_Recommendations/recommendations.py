@@ -1,6 +1,9 @@
 # -*- coding:utf-8 -*-
 
 from math import sqrt
+import heapq
+import multiprocessing
+import os
 import pprint
 
 
@@ -57,30 +60,65 @@ def topMatches(prefs, person, n=5, similarity=sim_pearson):
     从原始数据中返回与当前用户最为匹配的前n个用户
     :param prefs:
     :param person:
-    :param n:
-    :param similarity:
+    :param n: 返回的用户数，为None时返回完整排名
+    :param similarity: 相似度函数，或者提供scores方法的向量化后端（见simmatrix）
     :return:
     """
-    scores = [(similarity(prefs, person, other), other) for other in prefs if other != person]
-    scores.sort()
-    scores.reverse()
-    return scores[0 : n]
+    if hasattr(similarity, 'scores'):
+        scores = similarity.scores(prefs, person)
+    else:
+        scores = [(similarity(prefs, person, other), other) for other in prefs if other != person]
+    return topN(scores, n)
+
+
+def topN(rankings, n=None):
+    """
+    从(分数, 物品)序列中选出分数最高的n个，用堆选择代替完整排序，
+    开销为O(len(rankings) * log n)
+    :param rankings:
+    :param n: 为None时返回完整的降序列表
+    :return: 降序排列的列表
+    """
+    if n is None:
+        rankings = list(rankings)
+        rankings.sort()
+        rankings.reverse()
+        return rankings
+    return heapq.nlargest(n, rankings)
 
 
-def getRecommendations(prefs, person, similarity=sim_pearson):
+def getRecommendations(prefs, person, similarity=sim_pearson, index=None, minCommon=1, n=None):
     """
     利用所有他人评价值的加权平均，为person推荐电影。
     基于用户的协同过滤。在用户量很大的系统中不适用。
+    传入倒排索引后只对与person共同评价过物品的用户计算相似度，
+    没有共同评价物品的用户相似度总是0，对结果没有影响。
     :param prefs:
     :param person:
-    :param similarity:
+    :param similarity: 相似度函数，或者提供scores方法的向量化后端（见simmatrix）
+    :param index: buildItemIndex返回的倒排索引，或者提供candidates方法的近似索引
+                  （见ann.LSHIndex），为None时遍历所有用户
+    :param minCommon: 至少共同评价过多少个物品的用户才参与计算（需要倒排索引）
+    :param n: 只返回前n个物品，为None时返回全部
     :return: 经过排序的物品列表
     """
     totals = {}
     simSums = {}
-    for other in prefs:
-        if other == person: continue
-        sim = similarity(prefs, person, other)
+    if hasattr(index, 'candidates'):
+        others = index.candidates(prefs, person)
+    elif index is not None:
+        others = coRatedUsers(prefs, index, person, minCommon)
+    else:
+        others = [other for other in prefs if other != person]
+    if hasattr(similarity, 'scores'):
+        if index is None:
+            # 没有索引时scores已经覆盖所有用户，只需要去掉person自己
+            sims = [(other, sim) for sim, other in similarity.scores(prefs, person) if other != person]
+        else:
+            sims = [(other, sim) for sim, other in similarity.scores(prefs, person, others)]
+    else:
+        sims = ((other, similarity(prefs, person, other)) for other in others)
+    for other, sim in sims:
         if sim <= 0: continue
         for item in prefs[other]:
             if item not in prefs[person] or prefs[person][item] == 0:
@@ -89,10 +127,8 @@ def getRecommendations(prefs, person, similarity=sim_pearson):
                 simSums.setdefault(item, 0)
                 simSums[item] += sim
     # 建立一个归一化列表
-    rankings = [(total / simSums[item], item) for item, total in totals.items()]
-    rankings.sort()
-    rankings.reverse()
-    return rankings
+    rankings = ((total / simSums[item], item) for item, total in totals.items())
+    return topN(rankings, n)
 
 
 def transformPrefs(prefs):
@@ -109,32 +145,109 @@ def transformPrefs(prefs):
     return result
 
 
-def calculateSimilarItems(prefs, n = 10):
+def buildItemIndex(prefs):
+    """
+    建立倒排索引：物品 -> 评价过该物品的用户集合
+    prefs新增评分后可以直接更新：index.setdefault(item, set()).add(person)
+    :param prefs:
+    :return:
+    """
+    index = {}
+    for person in prefs:
+        for item in prefs[person]:
+            index.setdefault(item, set())
+            index[item].add(person)
+    return index
+
+
+def coRatedUsers(prefs, index, person, k=1):
+    """
+    利用倒排索引找出与person至少共同评价过k个物品的其他用户，
+    开销只与这些物品的评价人数有关，与用户总数无关
+    :param prefs:
+    :param index: buildItemIndex的返回值
+    :param person:
+    :param k:
+    :return: 用户列表
+    """
+    counts = {}
+    for item in prefs[person]:
+        for other in index.get(item, ()):
+            if other == person: continue
+            counts.setdefault(other, 0)
+            counts[other] += 1
+    return [other for other, c in counts.items() if c >= k]
+
+
+def calculateSimilarItems(prefs, n = 10, similarity=sim_distance, processes=1,
+                          progress=None, chunksize=100):
     """
     计算物品之间的相似度
     :param prefs:
     :param n:
+    :param similarity: 相似度函数；传入提供topMatrix方法的向量化后端时按块一次算完
+    :param processes: 进程数，1表示在当前进程中计算，None表示使用全部CPU
+    :param progress: 进度回调progress(已完成数, 物品总数)，例如printProgress
+    :param chunksize: 每个分片包含的物品数
     :return: 字典，给出与这些物品最为相近的topn的其他物品
     """
     result = {}
     itemPrefs = transformPrefs(prefs)
-    c = 0
-    for item in itemPrefs:
-        # 针对大数据集更新状态变量
-        c += 1
-        if c % 100 == 0: print "%d / %d" % (c, len(itemPrefs))
-        # 寻找最为相近的物品
-        scores = topMatches(itemPrefs, item, n=n, similarity=sim_distance)
-        result[item] = scores
+    items = list(itemPrefs)
+    shards = [items[i : i + chunksize] for i in range(0, len(items), chunksize)]
+    if processes == 1:
+        for shard in shards:
+            result.update(_similarItems(itemPrefs, shard, n, similarity))
+            if progress: progress(len(result), len(items))
+        return result
+
+    # 转置后的评分数据只在启动子进程时传递一次（fork时直接共享），
+    # 每个任务只传递分片中的物品列表
+    pool = multiprocessing.Pool(processes, _initSimilarItems, (itemPrefs, n, similarity))
+    try:
+        for scores in pool.imap_unordered(_similarItemsShard, shards):
+            result.update(scores)
+            if progress: progress(len(result), len(items))
+    finally:
+        pool.close()
+        pool.join()
     return result
 
 
-def getRecommendedItems(prefs, itemMatch, user):
+def printProgress(done, total):
+    print "%d / %d" % (done, total)
+
+
+def _similarItems(itemPrefs, items, n, similarity):
+    """
+    计算一个分片中每个物品最为相近的n个物品
+    """
+    if hasattr(similarity, 'topMatrix'):
+        return similarity.topMatrix(itemPrefs, n, keys=items)
+    return dict((item, topMatches(itemPrefs, item, n=n, similarity=similarity)) for item in items)
+
+
+# 子进程中只读共享的数据，由_initSimilarItems在进程启动时设置
+_shared = {}
+
+
+def _initSimilarItems(itemPrefs, n, similarity):
+    _shared['itemPrefs'] = itemPrefs
+    _shared['n'] = n
+    _shared['similarity'] = similarity
+
+
+def _similarItemsShard(items):
+    return _similarItems(_shared['itemPrefs'], items, _shared['n'], _shared['similarity'])
+
+
+def getRecommendedItems(prefs, itemMatch, user, n=None):
     """
     基于物品的协同过滤，为user推荐物品
     :param prefs:
     :param itemMatch:
     :param user:
+    :param n: 只返回前n个物品，为None时返回全部
     :return:
     """
     userRatings = prefs[user]
@@ -150,24 +263,24 @@ def getRecommendedItems(prefs, itemMatch, user):
             scores[item2] += similarity * rating
             totalSim.setdefault(item2, 0)
             totalSim[item2] += similarity
-    # 将每个合计值除以加权和，求出平均值
-    rankings = [(score / totalSim[item], item) for item, score in scores.items()]
-    rankings.sort()
-    rankings.reverse()
-    return rankings
+    # 将每个合计值除以加权和，求出平均值（皮尔逊相似度可能正负抵消为0，这样的物品无法预测）
+    rankings = ((score / totalSim[item], item) for item, score in scores.items()
+                if totalSim[item] != 0)
+    return topN(rankings, n)
 
 
-def loadMovieLens():
+def loadMovieLens(path=os.path.dirname(os.path.abspath(__file__))):
     """
-    载入movielens数据
+    载入movielens数据，需要反复载入大数据集时使用movielens.loadRatings
+    :param path: 数据所在目录，默认为本模块所在目录
     :return:
     """
     movies = {}
-    for line in open('u.item'):
+    for line in open(os.path.join(path, 'u.item')):
         (id, title) = line.split('|')[0:2]
         movies[id] = title
     prefs = {}
-    for line in open('u.data'):
+    for line in open(os.path.join(path, 'u.data')):
         (user, movieid, rating, ts) = line.split('\t')
         prefs.setdefault(user, {})
         prefs[user][movies[movieid]] = float(rating)
@@ -213,7 +326,7 @@ if __name__ == "__main__":
 
     prefs = loadMovieLens()
     print u'\n==============基于用户的推荐==============='
-    pprint.pprint(getRecommendations(prefs, '87')[0 : 10])
+    pprint.pprint(getRecommendations(prefs, '87', n=10))
     print u'\n==============基于物品的推荐==============='
-    itemsim = calculateSimilarItems(prefs, 50)
-    pprint.pprint(getRecommendedItems(prefs, itemsim, '87')[0 : 10])
\ No newline at end of file
+    itemsim = calculateSimilarItems(prefs, 50, progress=printProgress)
+    pprint.pprint(getRecommendedItems(prefs, itemsim, '87', n=10))
\ No newline at end of file
@@ -0,0 +1,288 @@
+# -*- coding:utf-8 -*-
+
+"""
+基于NumPy的向量化相似度计算。
+
+把prefs一次性转换为稀疏的用户×物品评分矩阵，再按块计算整行或者全部配对的
+皮尔逊相关系数/欧式距离相似度，结果与recommendations中的sim_pearson、
+sim_distance一致（只在双方都评价过的物品上计算）。
+
+通过现有的similarity参数即可启用：
+    getRecommendations(prefs, '87', similarity=sim_pearson_matrix)
+    calculateSimilarItems(prefs, 50, similarity=sim_distance_matrix)
+
+recommendAll用一次稀疏矩阵乘法为所有用户计算基于物品的推荐：
+    for chunk in recommendAll(prefs, calculateSimilarItems(prefs, 50), n=10):
+        ...
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+class RatingMatrix:
+    def __init__(self, prefs):
+        """
+        把prefs转换为稀疏矩阵，行对应prefs中的键，列对应被评价的物品
+        :param prefs: 数据集，{行: {列: 评分}}
+        """
+        self.keys = list(prefs)
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+        self.items = []
+        self.itemIndex = {}
+        rows, cols, values = [], [], []
+        for i, key in enumerate(self.keys):
+            for item, rating in prefs[key].items():
+                if item not in self.itemIndex:
+                    self.itemIndex[item] = len(self.items)
+                    self.items.append(item)
+                rows.append(i)
+                cols.append(self.itemIndex[item])
+                values.append(rating)
+        shape = (len(self.keys), len(self.items))
+        values = np.array(values, dtype=np.float64)
+        # 评分矩阵、评分平方矩阵以及“是否评价过”的掩码矩阵。
+        # 掩码单独保存，因为评分为0的物品同样算作共同评价过的物品
+        self.R = sparse.csr_matrix((values, (rows, cols)), shape=shape)
+        self.R2 = sparse.csr_matrix((values * values, (rows, cols)), shape=shape)
+        self.M = sparse.csr_matrix((np.ones(len(values)), (rows, cols)), shape=shape)
+        self.RT = self.R.T.tocsr()
+        self.R2T = self.R2.T.tocsr()
+        self.MT = self.M.T.tocsr()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def block(self, rows, metric='pearson', cols=None):
+        """
+        计算若干行与所有行（或cols中的行）之间的相似度
+        :param rows: 行下标列表
+        :param metric: 'pearson'或'distance'
+        :param cols: 只与这些行计算，默认为全部行
+        :return: len(rows)×len(self)（或len(rows)×len(cols)）的相似度数组
+        """
+        if cols is None:
+            A, A2, Am = self.R[rows], self.R2[rows], self.M[rows]
+            n = (Am * self.MT).toarray()
+            # 只在双方都评价过的物品上求和
+            sum1 = (A * self.MT).toarray()
+            sum2 = (Am * self.RT).toarray()
+            sum1Sq = (A2 * self.MT).toarray()
+            sum2Sq = (Am * self.R2T).toarray()
+            pSum = (A * self.RT).toarray()
+        else:
+            # 取出cols对应的行，按 A·B' = (B·A')' 计算，不需要对转置矩阵按列切片；
+            # rows通常很少，A'用稠密数组，每一项都是稀疏矩阵乘稠密向量
+            B, B2, Bm = _takeRows(self.R, cols), _takeRows(self.R2, cols), _takeRows(self.M, cols)
+            AT, A2T, AmT = [_takeRows(X, rows).toarray().T for X in (self.R, self.R2, self.M)]
+            n = (Bm * AmT).T
+            sum1 = (Bm * AT).T
+            sum2 = (B * AmT).T
+            sum1Sq = (Bm * A2T).T
+            sum2Sq = (B2 * AmT).T
+            pSum = (B * AT).T
+        return similarityFromSums(n, sum1, sum2, sum1Sq, sum2Sq, pSum, metric)
+
+    def blocks(self, metric='pearson', blocksize=256, rows=None):
+        """
+        分块遍历相似度矩阵，内存占用为blocksize×len(self)
+        :param metric:
+        :param blocksize: 每块的行数
+        :param rows: 只计算这些行，默认为全部行
+        :return: 生成(行下标数组, 相似度块)
+        """
+        if rows is None:
+            rows = np.arange(len(self.keys))
+        rows = np.asarray(rows)
+        for start in range(0, len(rows), blocksize):
+            part = rows[start : start + blocksize]
+            yield part, self.block(part, metric)
+
+    def pairwise(self, metric='pearson', blocksize=256):
+        """
+        返回完整的len(self)×len(self)相似度矩阵
+        """
+        result = np.empty((len(self.keys), len(self.keys)))
+        for part, sim in self.blocks(metric, blocksize):
+            result[part] = sim
+        return result
+
+
+class MatrixSimilarity:
+    def __init__(self, metric='pearson', blocksize=256):
+        """
+        可以直接作为similarity参数传入topMatches、getRecommendations和
+        calculateSimilarItems的相似度后端。
+        评分矩阵按prefs对象缓存，prefs被原地修改后需要调用reset()
+        :param metric: 'pearson'或'distance'
+        :param blocksize: 分块计算时每块的行数
+        """
+        self.metric = metric
+        self.blocksize = blocksize
+        self.reset()
+
+    def reset(self):
+        self._prefs = None
+        self._matrix = None
+
+    def __getstate__(self):
+        # 传给子进程时不携带缓存的矩阵
+        return {'metric': self.metric, 'blocksize': self.blocksize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def matrix(self, prefs):
+        if prefs is not self._prefs:
+            self._matrix = RatingMatrix(prefs)
+            self._prefs = prefs
+        return self._matrix
+
+    def __call__(self, prefs, p1, p2):
+        m = self.matrix(prefs)
+        return float(m.block([m.index[p1]], self.metric)[0, m.index[p2]])
+
+    def scores(self, prefs, person, others=None):
+        """
+        一次算出person与其他所有人的相似度
+        :param others: 只计算与这些键的相似度（例如近似索引给出的候选），默认为所有人
+        :return: [(相似度, other), ...]，不包含person本身，未排序
+        """
+        m = self.matrix(prefs)
+        i = m.index[person]
+        if others is None:
+            sim = m.block([i], self.metric)[0]
+            return [(float(sim[j]), other) for j, other in enumerate(m.keys) if j != i]
+        others = [other for other in others if other != person and other in m.index]
+        if not others:
+            return []
+        sim = m.block([i], self.metric, [m.index[other] for other in others])[0]
+        return zip(sim.tolist(), others)
+
+    def topMatrix(self, prefs, n=5, keys=None):
+        """
+        分块计算每一行最相似的前n个其他行，等价于对每个键调用topMatches
+        :param prefs:
+        :param n:
+        :param keys: 只计算这些键，默认为全部
+        :return: {key: [(相似度, other), ...]}
+        """
+        m = self.matrix(prefs)
+        rows = None if keys is None else [m.index[key] for key in keys]
+        result = {}
+        for part, sim in m.blocks(self.metric, self.blocksize, rows):
+            sim[np.arange(len(part)), part] = -np.inf
+            for row, i in zip(sim, part):
+                result[m.keys[i]] = topScores(row, m.keys, n)
+        return result
+
+
+def _takeRows(X, rows):
+    """
+    按indptr直接取出csr矩阵X的若干行，行数不多时比X[rows]快得多
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    starts = X.indptr[rows]
+    lengths = X.indptr[rows + 1] - starts
+    indptr = np.zeros(len(rows) + 1, dtype=X.indptr.dtype)
+    np.cumsum(lengths, out=indptr[1:])
+    take = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+    return sparse.csr_matrix((X.data[take], X.indices[take], indptr), shape=(len(rows), X.shape[1]))
+
+
+def similarityFromSums(n, sum1, sum2, sum1Sq, sum2Sq, pSum, metric='pearson'):
+    """
+    由共同评价的物品上的充分统计量计算相似度，公式与sim_pearson、sim_distance相同
+    :param n: 共同评价的物品数
+    :param sum1: 第一方在这些物品上的评分和
+    :param sum2: 第二方在这些物品上的评分和
+    :param sum1Sq: 第一方的评分平方和
+    :param sum2Sq: 第二方的评分平方和
+    :param pSum: 评分乘积之和
+    :param metric: 'pearson'或'distance'
+    :return: 相似度数组，没有共同评价物品时为0
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if metric == 'pearson':
+            num = pSum - sum1 * sum2 / n
+            den = (sum1Sq - sum1 ** 2 / n) * (sum2Sq - sum2 ** 2 / n)
+            den = np.sqrt(np.where(den > 0, den, 0))
+            sim = np.where(den > 0, num / den, 0.0)
+        elif metric == 'distance':
+            sumOfSquares = np.maximum(sum1Sq + sum2Sq - 2 * pSum, 0)
+            sim = 1 / (1 + sumOfSquares)
+        else:
+            raise ValueError('unknown metric %r' % metric)
+    sim = np.asarray(sim, dtype=np.float64)
+    sim[np.asarray(n) == 0] = 0.0
+    return sim
+
+
+def topScores(row, keys, n):
+    """
+    从一行相似度中选出最大的n个，-inf表示不参与排序
+    先用partition找出第n大的值，只对不小于它的候选排序，
+    这样并列的分数与topMatches的排序规则保持一致
+    :param row: 相似度数组
+    :param keys: 与row对应的键
+    :param n:
+    :return: [(相似度, 键), ...]
+    """
+    valid = np.flatnonzero(row > -np.inf)
+    k = min(n, len(valid))
+    if k <= 0:
+        return []
+    kth = np.partition(row[valid], -k)[-k]
+    candidates = [(float(row[j]), keys[j]) for j in valid[row[valid] >= kth]]
+    candidates.sort()
+    candidates.reverse()
+    return candidates[0 : n]
+
+
+def recommendAll(prefs, itemMatch, n=10, chunksize=1000):
+    """
+    批量执行基于物品的协同过滤，结果与对每个用户调用getRecommendedItems相同。
+    评分矩阵R（用户×物品）与近邻矩阵S（物品×物品，S[item, item2]为相似度）相乘，
+    再除以“是否评价过”矩阵与S的乘积（相似度之和）完成归一化
+    :param prefs:
+    :param itemMatch: calculateSimilarItems的结果或其他同样格式的映射
+    :param n: 每个用户返回的物品数
+    :param chunksize: 每次计算的用户数，决定内存占用
+    :return: 逐块生成{user: [(预测评分, item), ...]}
+    """
+    m = RatingMatrix(prefs)
+    items = list(m.items)
+    itemIndex = dict(m.itemIndex)
+    rows, cols, sims = [], [], []
+    for item in itemMatch:
+        for similarity, item2 in itemMatch[item]:
+            for key in (item, item2):
+                if key not in itemIndex:
+                    itemIndex[key] = len(items)
+                    items.append(key)
+            rows.append(itemIndex[item])
+            cols.append(itemIndex[item2])
+            sims.append(similarity)
+    shape = (len(items), len(items))
+    S = sparse.csr_matrix((np.array(sims, dtype=np.float64), (rows, cols)), shape=shape)
+    linked = sparse.csr_matrix((np.ones(len(sims)), (rows, cols)), shape=shape)
+    userShape = (len(m.keys), len(items))
+    R = sparse.csr_matrix((m.R.data, m.R.indices, m.R.indptr), shape=userShape)
+    M = sparse.csr_matrix((m.M.data, m.M.indices, m.M.indptr), shape=userShape)
+
+    for start in range(0, len(m.keys), chunksize):
+        Rc, Mc = R[start : start + chunksize], M[start : start + chunksize]
+        scores = (Rc * S).toarray()
+        totalSim = (Mc * S).toarray()
+        # 只有与用户评价过的物品相近、且用户尚未评价的物品才参与排名
+        candidate = ((Mc * linked).toarray() > 0) & (Mc.toarray() == 0) & (totalSim != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rankings = np.where(candidate, scores / totalSim, -np.inf)
+        chunk = {}
+        for k, row in enumerate(rankings):
+            chunk[m.keys[start + k]] = topScores(row, items, n)
+        yield chunk
+
+
+sim_pearson_matrix = MatrixSimilarity('pearson')
+sim_distance_matrix = MatrixSimilarity('distance')
@@ -0,0 +1,177 @@
+# -*- coding:utf-8 -*-
+
+# 0/1偏好数据（例如zebo.txt中的“想要”）的位集表示。
+# 每一行保存为一个Python整数，第i位对应第i列，tanamoto距离只需要对按位与、按位或
+# 的结果数1的个数；批量计算时把位集打包成uint64数组，按块做按位与和查表计数。
+# 注册之后hCluster、hClusterLinkage和kCluster可以直接通过distance参数使用：
+#
+#     wants, people, rows = readBits('zebo.txt')
+#     clust = hCluster(rows, distance=tanamotoBits)
+#     kclust = kCluster(rows, distance=tanamotoBits, k=4)
+
+import binascii
+import numpy as np
+from cluster import (batchDistances, rowMatrices, mergeFunctions, centroidFunctions,
+                     asMatrix, hCluster, drawdendrogrom)
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_H01 = np.uint64(0x0101010101010101)
+
+
+# 整数中1的个数
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+# 把一行0/1（或任意数值，非零即为1）转换为位集
+def toBits(row):
+    bits = 0
+    for i in range(len(row)):
+        if row[i] != 0:
+            bits |= 1 << i
+    return bits
+
+
+# 把位集还原为长度为width的0/1列表
+def fromBits(bits, width):
+    return [(bits >> i) & 1 for i in range(width)]
+
+
+# 读取与readFile格式相同的0/1文件，每行直接解析为位集，不生成浮点数列表
+def readBits(filename):
+    f = open(filename)
+    try:
+        colnames = f.readline().strip().split('\t')[1:]
+        rownames = []
+        rows = []
+        for line in f:
+            p = line.strip().split('\t')
+            rownames.append(p[0])
+            # 第0列在最低位，所以倒序拼接成二进制字符串
+            rows.append(int(''.join(['0' if float(x) == 0 else '1' for x in reversed(p[1:])]) or '0', 2))
+    finally:
+        f.close()
+    return rownames, colnames, rows
+
+
+# 把多行打包成(行数, 字数)的uint64数组，第j个字的第b位对应第64j+b列。
+# rows可以是位集列表、0/1矩阵，或者已经打包好的数组
+def packBits(rows, words=None):
+    if isinstance(rows, np.ndarray) and rows.dtype == np.uint64:
+        packed = rows
+    elif len(rows) > 0 and isinstance(rows[0], (int, long)) and not isinstance(rows[0], bool):
+        count = max(1, max((bits.bit_length() + 63) // 64 for bits in rows))
+        packed = np.zeros((len(rows), count), dtype=np.uint64)
+        for i in range(len(rows)):
+            # 十六进制字符串是大端的，倒序之后按小端解释为uint64
+            raw = binascii.unhexlify('%0*x' % (count * 16, rows[i]))[::-1]
+            packed[i] = np.frombuffer(raw, dtype='<u8')
+    else:
+        dense = asMatrix(rows).reshape(len(rows), -1) != 0
+        n, width = dense.shape
+        count = max(1, (width + 63) // 64)
+        padded = np.zeros((n, count * 64), dtype=np.uint8)
+        padded[:, :width] = dense
+        # np.packbits按大端顺序打包每个字节，先把每8列倒序
+        packed = np.packbits(padded.reshape(n, -1, 8)[:, :, ::-1], axis=2)
+        packed = np.ascontiguousarray(packed.reshape(n, -1)).view('<u8').astype(np.uint64)
+    if words is not None and packed.shape[1] < words:
+        packed = np.hstack([packed, np.zeros((len(packed), words - packed.shape[1]), dtype=np.uint64)])
+    return packed
+
+
+# packBits的逆运算，返回(行数, width)的0/1数组
+def unpackBits(packed, width):
+    packed = packBits(packed)
+    raw = np.ascontiguousarray(packed.astype('<u8')).view(np.uint8).reshape(len(packed), -1, 1)
+    bits = np.unpackbits(raw, axis=2)[:, :, ::-1].reshape(len(packed), -1)
+    return bits[:, :width]
+
+
+# uint64数组中每个元素1的个数（SWAR算法，全部是原地的向量运算），会修改x
+def _popcountWords(x):
+    x -= (x >> np.uint64(1)) & _M1
+    x[...] = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x += x >> np.uint64(4)
+    x &= _M4
+    x *= _H01
+    x >>= np.uint64(56)
+    return x
+
+
+# 打包后每一行中1的个数
+def countBits(packed):
+    return _popcountWords(packed.copy()).sum(axis=-1)
+
+
+# 位集之间的tanamoto距离
+def tanamotoBits(v1, v2):
+    union = popcount(v1 | v2)
+    if union == 0:
+        return 0.0
+    return 1.0 - float(popcount(v1 & v2)) / union
+
+
+# tanamotoBits的批量版本：A中每一行与B中每一行的距离。
+# 按块计算A的若干行与B的按位与，每块的临时数组不超过blockbytes字节；
+# 块中A的各行全为0的字不可能有共同的位，直接跳过，稀疏的数据只需要读很少的字
+def tanamotoBitsMatrix(A, B, blockbytes=1 << 23):
+    A = packBits(A)
+    B = packBits(B)
+    words = max(A.shape[1], B.shape[1])
+    A = packBits(A, words)
+    B = packBits(B, words)
+    countA = countBits(A)
+    countB = countBits(B)
+    shr = np.empty((len(A), len(B)))
+    step = max(1, blockbytes // max(1, B.nbytes))
+    for start in range(0, len(A), step):
+        block = A[start : start + step]
+        cols = np.flatnonzero(block.any(axis=0))
+        both = block[:, np.newaxis, cols] & B[:, cols][np.newaxis]
+        shr[start : start + step] = _popcountWords(both).sum(axis=2)
+    union = countA[:, np.newaxis] + countB[np.newaxis, :] - shr
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 与tanamotoMatrix相同，两行都没有1时视为完全相同
+        return np.where(union > 0, 1.0 - shr / union, 0.0)
+
+
+# 合并两个聚类：平均向量的非零项就是两者非零项的并集，所以按位或的结果完全等价
+def orBits(v1, v2):
+    return v1 | v2
+
+
+# k-means的中心点：至少半数成员拥有的位，没有这样的位时取成员中出现次数最多的位。
+# 直接在打包的uint64数组上逐个位置移位、取最低位再按列求和，
+# 额外内存与打包后的数组相同，不需要展开成每位一个字节
+def majorityBits(members):
+    packed = packBits(members)
+    counts = np.empty((64, packed.shape[1]), dtype=np.int64)
+    for b in range(64):
+        counts[b] = ((packed >> np.uint64(b)) & np.uint64(1)).sum(axis=0)
+    keep = 2 * counts >= len(members)
+    if not keep.any():
+        keep = counts == counts.max()
+    words = np.zeros(packed.shape[1], dtype=np.uint64)
+    for b in range(64):
+        words |= keep[b].astype(np.uint64) << np.uint64(b)
+    return wordsToBits(words)
+
+
+# 把一行打包后的uint64数组转换回位集
+def wordsToBits(words):
+    return int(binascii.hexlify(words.astype('<u8').tostring()[::-1]), 16)
+
+
+batchDistances[tanamotoBits] = tanamotoBitsMatrix
+rowMatrices[tanamotoBits] = packBits
+mergeFunctions[tanamotoBits] = orBits
+centroidFunctions[tanamotoBits] = majorityBits
+
+
+if __name__ == '__main__':
+    wants, people, rows = readBits('zebo.txt')
+    clust = hCluster(rows, distance=tanamotoBits)
+    drawdendrogrom(clust, wants)
@@ -1,19 +1,97 @@
 # -*- coding:utf-8 -*-
 
 from PIL import Image, ImageDraw
+import itertools
+import multiprocessing
+import numpy as np
 import random
+from scipy import sparse
+from feedmatrix import isSparse, readSparse, loadMatrix, sparseBase, sparseFiles
+
+
+# 也可以读取稀疏格式（见feedmatrix）；asSparse为True时data是scipy.sparse.csr_matrix，
+# 可以直接传给hClusterLinkage、kClusterPlus、hClusterCanopy和landmarkMDS。
+# 数据较大时用loadMatrix，得到紧凑的float32数组或稀疏矩阵，并带有二进制缓存
+def readFile(filename, asSparse=False):
+    if isSparse(filename):
+        rownames, colnames, matrix = readSparse(filename)
+        return rownames, colnames, matrix if asSparse else matrix.toarray().tolist()
+    f = open(filename)
+    try:
+        colnames = f.readline().strip().split('\t')[1:]
+        rownames = []
+        data = []
+        for line in f:
+            p = line.strip().split('\t')
+            rownames.append(p[0])
+            data.append([float(x) for x in p[1:]])
+    finally:
+        f.close()
+    if asSparse:
+        data = sparse.csr_matrix(data)
+    return rownames, colnames, data
 
 
-def readFile(filename):
-    lines = [line for line in file(filename)]
-    colnames = lines[0].strip().split('\t')[1:]
-    rownames = []
-    data = []
-    for line in lines[1:]:
-        p = line.strip().split('\t')
-        rownames.append(p[0])
-        data.append([float(x) for x in p[1:]])
-    return rownames, colnames, data
+# 按块读取与readFile格式相同的文件，内存占用只与chunksize有关。
+# 返回列名和一个逐块生成(行名列表, 数据数组)的生成器。
+# 稀疏格式（见feedmatrix）的每一块是chunksize行的scipy.sparse.csr_matrix
+def readFileChunks(filename, chunksize=1000):
+    if isSparse(filename):
+        return _readSparseChunks(filename, chunksize)
+    f = open(filename)
+    colnames = f.readline().strip().split('\t')[1:]
+
+    def chunks():
+        try:
+            rownames, data = [], []
+            for line in f:
+                p = line.strip().split('\t')
+                rownames.append(p[0])
+                data.append([float(x) for x in p[1:]])
+                if len(data) == chunksize:
+                    yield rownames, np.array(data)
+                    rownames, data = [], []
+            if data:
+                yield rownames, np.array(data)
+        finally:
+            f.close()
+    return colnames, chunks()
+
+
+# .coo文件按行号排序，所以行名和非零项都可以顺序读取，不需要载入整个矩阵
+def _readSparseChunks(filename, chunksize):
+    rows, vocab, coo = sparseFiles(sparseBase(filename))
+    f = open(vocab)
+    try:
+        colnames = [line.rstrip('\n') for line in f]
+    finally:
+        f.close()
+
+    def chunks():
+        names = open(rows)
+        values = open(coo)
+        try:
+            entries = (line.split() for line in values if line.strip())
+            entry = next(entries, None)
+            start = 0
+            while True:
+                rownames = [line.rstrip('\n') for line in itertools.islice(names, chunksize)]
+                if not rownames:
+                    return
+                end = start + len(rownames)
+                i, j, v = [], [], []
+                while entry is not None and int(entry[0]) < end:
+                    i.append(int(entry[0]) - start)
+                    j.append(int(entry[1]))
+                    v.append(float(entry[2]))
+                    entry = next(entries, None)
+                yield rownames, sparse.csr_matrix((np.array(v, dtype=np.float64), (i, j)),
+                                                  shape=(len(rownames), len(colnames)))
+                start = end
+        finally:
+            names.close()
+            values.close()
+    return colnames, chunks()
 
 
 from math import sqrt
@@ -41,16 +119,30 @@ class biCluster:
         self.vec = vec
         self.id = id
         self.distance = distance
+        # 由layoutTree计算并缓存的叶节点数和深度
+        self.height = None
+        self.depth = None
 
 
-def hCluster(rows, distance=pearson):
+# dist可以传入预先计算好的叶节点之间的距离矩阵（见distanceMatrix）。
+# dist只用于叶节点之间，合并产生的新聚类与其他聚类的距离仍然用distance计算，
+# 所以dist应当是用同一个distance算出来的
+def hCluster(rows, distance=pearson, dist=None):
     distances = {}
     currentClustID = -1
+    if dist is not None:
+        dist = squareDistances(dist, len(rows))
+        for i in range(len(rows)):
+            for j in range(i + 1, len(rows)):
+                distances[(i, j)] = dist[i, j]
 
+    merge = mergeFunctions.get(distance, averageVectors)
     clust = [biCluster(rows[i], id=i) for i in range(len(rows))]
     while len(clust) > 1:
         lowestPair = (0, 1)
-        closest = distance(clust[0].vec, clust[1].vec)
+        if (clust[0].id, clust[1].id) not in distances:
+            distances[(clust[0].id, clust[1].id)] = distance(clust[0].vec, clust[1].vec)
+        closest = distances[(clust[0].id, clust[1].id)]
         # 遍历每一个配对，寻找最小距离
         for i in range(len(clust)):
             for j in range(i + 1, len(clust)):
@@ -61,8 +153,7 @@ def hCluster(rows, distance=pearson):
                     closest = d
                     lowestPair = (i, j)
         # 计算两个聚类的平均值
-        mergevec = [(clust[lowestPair[0]].vec[i] + clust[lowestPair[1]].vec[i]) / 2.0
-                    for i in range(len(clust[0].vec))]
+        mergevec = merge(clust[lowestPair[0]].vec, clust[lowestPair[1]].vec)
         # 建立新的聚类
         newCluster = biCluster(mergevec, left=clust[lowestPair[0]], right=clust[lowestPair[1]],
                                distance=closest, id=currentClustID)
@@ -75,36 +166,288 @@ def hCluster(rows, distance=pearson):
     return clust[0]
 
 
-def printClust(clust, labels=None, n=0):
-    # 利用缩进来建立层级布局
+def averageVectors(v1, v2):
+    if sparse.issparse(v1):
+        return (v1 + v2) / 2.0
+    return [(v1[i] + v2[i]) / 2.0 for i in range(len(v1))]
+
+
+# 计算所有配对的距离，按行优先顺序保存在长度为n(n-1)/2的压缩数组中。
+# 有批量版本的距离函数（见batchDistances）按块向量化计算，只需要blocksize×n的额外内存
+def condensedDistances(rows, distance=pearson, blocksize=256):
+    n = numRows(rows)
+    dist = np.empty(n * (n - 1) // 2)
+    if distance in batchDistances:
+        data = rowMatrices.get(distance, asMatrix)(rows)
+        for start in range(0, n, blocksize):
+            block = batchDistances[distance](data[start : start + blocksize], data)
+            for i in range(start, min(start + blocksize, n - 1)):
+                offset = condensedIndex(n, i, i + 1)
+                dist[offset : offset + n - i - 1] = block[i - start, i + 1:]
+        return dist
+    k = 0
     for i in range(n):
-        print ' ',
-    if clust.id < 0:
-        # 负数标记代表这是一个分支
-        print '_'
+        for j in range(i + 1, n):
+            dist[k] = distance(rows[i], rows[j])
+            k += 1
+    return dist
+
+
+# 把方阵或压缩数组形式的距离统一转换为方阵
+def squareDistances(dist, n):
+    dist = np.asarray(dist, dtype=np.float64)
+    if dist.ndim == 2:
+        return dist
+    square = np.zeros((n, n))
+    i, j = np.triu_indices(n, 1)
+    square[i, j] = dist
+    square[j, i] = dist
+    return square
+
+
+# 把方阵或压缩数组形式的距离统一转换为压缩数组
+def condensedFrom(dist, n):
+    dist = np.asarray(dist, dtype=np.float64)
+    if dist.ndim == 1:
+        return dist.copy()
+    return dist[np.triu_indices(n, 1)]
+
+
+# 压缩数组中第i行与第j列（i != j）对应的下标，j可以是数组
+def condensedIndex(n, i, j):
+    lo = np.minimum(i, j)
+    hi = np.maximum(i, j)
+    return n * lo - lo * (lo + 1) // 2 + (hi - lo - 1)
+
+
+# 使用最近邻链算法的层次聚类，复杂度为O(n^2)，只使用一个压缩距离数组。
+# linkage可以是'single'、'complete'或'average'，返回与hCluster相同的biCluster树
+# dist可以传入预先计算好的距离（方阵或压缩数组）
+def hClusterLinkage(rows, distance=pearson, linkage='average', dist=None):
+    n = numRows(rows)
+    if linkage not in ('single', 'complete', 'average'):
+        raise ValueError('unknown linkage %r' % linkage)
+    if n == 0:
+        return None
+    if dist is None:
+        dist = condensedDistances(rows, distance)
     else:
-        # 正数标记代表这是一个叶节点
-        if labels == None:
-            print clust.id
+        dist = condensedFrom(dist, n)
+    size = np.ones(n)
+    active = np.ones(n, dtype=bool)
+    slots = np.arange(n)
+    merges = []
+    chain = []
+    while len(merges) < n - 1:
+        if not chain:
+            chain.append(int(np.flatnonzero(active)[0]))
+        a = chain[-1]
+        # 与a距离最近的活动聚类，距离相等时优先选择链上的前一个聚类，保证链能终止
+        rowA = condensedIndex(n, a, slots)
+        da = np.where(active, dist[np.where(slots == a, 0, rowA)], np.inf)
+        da[a] = np.inf
+        b = int(np.argmin(da))
+        if len(chain) > 1 and da[chain[-2]] == da[b]:
+            b = chain[-2]
+        if len(chain) < 2 or b != chain[-2]:
+            chain.append(b)
+            continue
+
+        # a与b互为最近邻，合并后的聚类保存在b的位置上
+        chain.pop()
+        chain.pop()
+        merges.append((float(da[b]), a, b))
+        active[a] = False
+        others = np.flatnonzero(active)
+        others = others[others != b]
+        ia = condensedIndex(n, a, others)
+        ib = condensedIndex(n, b, others)
+        # Lance-Williams公式更新新聚类到其他聚类的距离
+        if linkage == 'single':
+            dist[ib] = np.minimum(dist[ia], dist[ib])
+        elif linkage == 'complete':
+            dist[ib] = np.maximum(dist[ia], dist[ib])
         else:
-            print labels[clust.id]
+            dist[ib] = (size[a] * dist[ia] + size[b] * dist[ib]) / (size[a] + size[b])
+        size[b] += size[a]
+
+    # 按合并距离排序后重建树，id的分配顺序与hCluster一致（从-1开始递减）
+    merges.sort(key=lambda m: m[0])
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
 
-    if clust.left != None:
-        printClust(clust.left, labels=labels, n=n+1)
-    if clust.left != None:
-        printClust(clust.right, labels=labels, n=n+1)
+    merge = mergeFunctions.get(distance, averageVectors)
+    nodes = dict((i, biCluster(rows[i], id=i)) for i in range(n))
+    currentClustID = -1
+    for d, a, b in merges:
+        ra, rb = find(a), find(b)
+        left, right = nodes.pop(ra), nodes.pop(rb)
+        parent[ra] = rb
+        nodes[rb] = biCluster(merge(left.vec, right.vec), left=left, right=right, distance=d, id=currentClustID)
+        currentClustID -= 1
+    return nodes[find(0)]
+
+
+# 两阶段层次聚类，用于数据太多、放不下n(n-1)/2个距离的情况：
+# 先做一遍廉价的canopy划分——随机选一个尚未被覆盖的点作为中心，距离在threshold以内的
+# 点不再作为候选中心——每个点归入最近的中心；然后在每个canopy内部用hClusterLinkage
+# 做精确的层次聚类，再对各子树根节点的向量做一次层次聚类，把子树拼接成一棵biCluster树。
+# 超过maxsize个点的canopy用减半的threshold继续划分。
+# 距离计算和内存大约为O(n·canopy数 + 最大canopy的平方)。
+# threshold为None时取随机抽样的距离的20%分位数。叶节点的id仍是rows中的下标，
+# 分支节点的id按合并的先后从-1开始递减
+def hClusterCanopy(rows, distance=pearson, threshold=None, maxsize=2000, linkage='average', seed=None):
+    n = numRows(rows)
+    if n == 0:
+        return None
+    rng = np.random.RandomState(seed)
+    tree = _canopyTree(rows, range(n), distance, threshold, maxsize, linkage, rng)
+
+    # 重新编号分支节点：后序遍历，子节点的编号先于父节点分配
+    currentClustID = -1
+    stack = [(tree, False)]
+    while stack:
+        node, visited = stack.pop()
+        if node.left == None:
+            continue
+        if visited:
+            node.id = currentClustID
+            currentClustID -= 1
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+    return tree
+
+
+# threshold减半到这个值以下时不再继续划分
+_minThreshold = 1e-9
+
+
+def _canopyTree(rows, members, distance, threshold, maxsize, linkage, rng):
+    subset = rows[members] if sparse.issparse(rows) else [rows[i] for i in members]
+    n = numRows(subset)
+    if n <= maxsize:
+        return _subTree(subset, members, distance, linkage)
+    batch = batchFor(distance)
+    data = rowMatrices.get(distance, asMatrix)(subset) if distance in batchDistances else subset
+    if threshold is None:
+        sample = rng.choice(n, min(n, 200), replace=False)
+        threshold = np.percentile(batch(data[sample[0] : sample[0] + 1], data)[0][sample[1:]], 20)
+
+    # canopy划分：同时记录每个点到最近中心的距离和中心的编号
+    nearest = np.empty(n)
+    nearest.fill(np.inf)
+    labels = np.zeros(n, dtype=int)
+    candidates = np.ones(n, dtype=bool)
+    centers = 0
+    while candidates.any():
+        c = rng.choice(np.flatnonzero(candidates))
+        d = batch(data[c : c + 1], data)[0]
+        closer = d < nearest
+        nearest[closer] = d[closer]
+        labels[closer] = centers
+        labels[c] = centers
+        candidates &= d > threshold
+        candidates[c] = False
+        centers += 1
+
+    groups = [np.flatnonzero(labels == i) for i in range(centers)]
+    groups = [group for group in groups if len(group) > 0]
+    if len(groups) == 1:
+        if nearest.max() > 0 and threshold > _minThreshold:
+            return _canopyTree(rows, members, distance, threshold / 2.0, maxsize, linkage, rng)
+        # 所有点到中心的距离都是0（例如大量重复的行），减小threshold也无法划分，
+        # 按顺序切成不超过maxsize个点的块，照常拼接
+        groups = [np.arange(start, min(start + maxsize, n)) for start in range(0, n, maxsize)]
+    trees = [_canopyTree(rows, [members[i] for i in group], distance, threshold / 2.0,
+                         maxsize, linkage, rng) for group in groups]
+
+    # 对各子树的根节点聚类，再把顶层树的叶节点替换为对应的子树
+    top = hClusterLinkage([tree.vec for tree in trees], distance, linkage)
+    if top.left == None:
+        return trees[top.id]
+    stack = [top]
+    while stack:
+        node = stack.pop()
+        for child in ('left', 'right'):
+            sub = getattr(node, child)
+            if sub.left == None:
+                setattr(node, child, trees[sub.id])
+            else:
+                stack.append(sub)
+    return top
+
+
+# 对members对应的行做精确的层次聚类，叶节点的id换成members中的原始下标
+def _subTree(subset, members, distance, linkage):
+    tree = hClusterLinkage(subset, distance, linkage)
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node.left == None:
+            node.id = members[node.id]
+        else:
+            stack += [node.left, node.right]
+    return tree
+
+
+def printClust(clust, labels=None, n=0):
+    # 用显式的栈代替递归，层次很深的树也不会超过递归深度限制
+    stack = [(clust, n)]
+    while stack:
+        clust, n = stack.pop()
+        # 利用缩进来建立层级布局
+        for i in range(n):
+            print ' ',
+        if clust.id < 0:
+            # 负数标记代表这是一个分支
+            print '_'
+        else:
+            # 正数标记代表这是一个叶节点
+            if labels == None:
+                print clust.id
+            else:
+                print labels[clust.id]
+
+        if clust.left != None:
+            stack.append((clust.right, n + 1))
+            stack.append((clust.left, n + 1))
+
+
+# 一次性后序遍历整棵树，把每个节点的高度（叶节点数）和深度缓存在节点上
+def layoutTree(clust):
+    stack = [(clust, False)]
+    while stack:
+        node, visited = stack.pop()
+        if node.left == None and node.right == None:
+            node.height = 1
+            node.depth = 0
+        elif visited:
+            node.height = node.left.height + node.right.height
+            node.depth = max(node.left.depth, node.right.depth) + node.distance
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+    return clust
 
 
 def getHeight(clust):
-    if clust.left == None and clust.right == None:
-        return 1
-    return getHeight(clust.left) + getHeight(clust.right)
+    if getattr(clust, 'height', None) is None:
+        layoutTree(clust)
+    return clust.height
 
 
 def getDepth(clust):
-    if clust.left == None and clust.right == None:
-        return 0
-    return max(getDepth(clust.left), getDepth(clust.right)) + clust.distance
+    if getattr(clust, 'depth', None) is None:
+        layoutTree(clust)
+    return clust.depth
 
 
 def drawdendrogrom(clust, labels, jpeg='clusters.jpg'):
@@ -122,25 +465,93 @@ def drawdendrogrom(clust, labels, jpeg='clusters.jpg'):
 
 
 def drawNode(draw, clust, x, y, scaling, labels):
-    if clust.id < 0:
-        h1 = getHeight(clust.left) * 20
-        h2 = getHeight(clust.right) * 20
-        top = y - (h1 + h2) / 2
-        bottom = y + (h1 + h2) / 2
-        # 线的长度
-        l1 = clust.distance * scaling
-        # 聚类到其子节点的垂直线
-        draw.line((x, top + h1 / 2, x, bottom - h2 / 2), fill=(255, 0, 0))
-        # 连接左侧节点的水平线
-        draw.line((x, top + h1 / 2, x + l1, top + h1 / 2), fill=(255, 0, 0))
-        # 连接右侧节点的水平线
-        draw.line((x, bottom - h2 / 2, x + l1, bottom - h2 / 2), fill=(255, 0, 0))
-
-        drawNode(draw, clust.left, x + l1, top + h1 / 2, scaling, labels)
-        drawNode(draw, clust.right, x + l1, bottom - h2 / 2, scaling, labels)
-    else:
-        # 如果这是一个叶节点，则绘制节点标签
-        draw.text((x + 5, y - 7), labels[clust.id], (0, 0, 0))
+    for kind, coords, id in dendrogramSegments(clust, x, y, scaling):
+        if kind == 'line':
+            draw.line(coords, fill=(255, 0, 0))
+        else:
+            # 如果这是一个叶节点，则绘制节点标签
+            draw.text(coords, labels[id], (0, 0, 0))
+
+
+# 依次生成画树状图需要的线段('line', 坐标, None)和标签('text', 坐标, 叶节点id)。
+# clip=(上边界, 下边界)时跳过完全在这个纵向范围之外的子树
+def dendrogramSegments(clust, x, y, scaling, rowheight=20, clip=None):
+    stack = [(clust, x, y)]
+    while stack:
+        clust, x, y = stack.pop()
+        if clust.id < 0:
+            h1 = getHeight(clust.left) * rowheight
+            h2 = getHeight(clust.right) * rowheight
+            top = y - (h1 + h2) / 2
+            bottom = y + (h1 + h2) / 2
+            if clip is not None and (bottom < clip[0] or top > clip[1]):
+                continue
+            # 线的长度
+            l1 = clust.distance * scaling
+            y1, y2 = top + h1 / 2, bottom - h2 / 2
+            # 聚类到其子节点的垂直线
+            if clip is None or (y2 >= clip[0] and y1 <= clip[1]):
+                yield 'line', (x, y1, x, y2), None
+            # 连接左侧节点的水平线
+            if clip is None or clip[0] <= y1 <= clip[1]:
+                yield 'line', (x, y1, x + l1, y1), None
+            # 连接右侧节点的水平线
+            if clip is None or clip[0] <= y2 <= clip[1]:
+                yield 'line', (x, y2, x + l1, y2), None
+
+            stack.append((clust.right, x + l1, y2))
+            stack.append((clust.left, x + l1, y1))
+        else:
+            if clip is not None and (y + rowheight < clip[0] or y - rowheight > clip[1]):
+                continue
+            yield 'text', (x + 5, y - 7), clust.id
+
+
+# 以SVG格式画树状图，边遍历边写入文件，内存占用与叶节点数无关
+def drawdendrogramSVG(clust, labels, svg='clusters.svg', rowheight=20, w=1200):
+    from xml.sax.saxutils import escape
+    h = getHeight(clust) * rowheight
+    scaling = float(w - 150) / getDepth(clust)
+    out = open(svg, 'w')
+    try:
+        out.write('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">\n' % (w, h))
+        out.write('<rect width="100%" height="100%" fill="white"/>\n')
+        out.write('<g stroke="red" font-family="sans-serif" font-size="11">\n')
+        out.write('<line x1="0" y1="%s" x2="10" y2="%s"/>\n' % (h / 2, h / 2))
+        for kind, coords, id in dendrogramSegments(clust, 10, h / 2, scaling, rowheight):
+            if kind == 'line':
+                out.write('<line x1="%s" y1="%s" x2="%s" y2="%s"/>\n' % coords)
+            else:
+                out.write('<text x="%s" y="%s" stroke="none" dominant-baseline="hanging">%s</text>\n'
+                          % (coords[0], coords[1], escape(str(labels[id]))))
+        out.write('</g>\n</svg>\n')
+    finally:
+        out.close()
+
+
+# 把很高的树状图切成若干张高度为tileheight的JPEG图片，一次只在内存中保留一张，
+# 每张图片只遍历与它相交的子树。返回生成的文件名列表
+def drawdendrogromTiles(clust, labels, prefix='clusters', tileheight=4000, rowheight=20, w=1200):
+    h = getHeight(clust) * rowheight
+    scaling = float(w - 150) / getDepth(clust)
+    filenames = []
+    for top in range(0, h, tileheight):
+        height = min(tileheight, h - top)
+        img = Image.new('RGB', (w, height), (255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        if top <= h / 2 < top + height:
+            draw.line((0, h / 2 - top, 10, h / 2 - top), fill=(255, 0, 0))
+        clip = (top - rowheight, top + height + rowheight)
+        for kind, coords, id in dendrogramSegments(clust, 10, h / 2, scaling, rowheight, clip):
+            if kind == 'line':
+                x1, y1, x2, y2 = coords
+                draw.line((x1, y1 - top, x2, y2 - top), fill=(255, 0, 0))
+            else:
+                draw.text((coords[0], coords[1] - top), labels[id], (0, 0, 0))
+        filename = '%s_%04d.jpg' % (prefix, len(filenames))
+        img.save(filename, 'JPEG')
+        filenames.append(filename)
+    return filenames
 
 
 def rotateMatrix(data):
@@ -152,31 +563,48 @@ def rotateMatrix(data):
 
 
 def kCluster(rows, distance=pearson, k=4):
-    # 确定每个点的最小值和最大值
-    ranges = [(min(row[i] for row in rows), max(row[i] for row in rows))
-              for i in range(len(rows[0]))]
-    # 随机创建k个中心点
-    clusters = [[random.random() * (ranges[i][1] - ranges[i][0]) + ranges[i][0]
-                 for i in range(len(rows[0]))] for j in range(k)]
+    centroid = centroidFunctions.get(distance)
+    if centroid is not None:
+        # 不能按列取随机值的数据（例如位集），随机选取k行作为初始中心点
+        clusters = [rows[i] for i in random.sample(range(len(rows)), k)]
+    else:
+        # 确定每个点的最小值和最大值
+        ranges = [(min(row[i] for row in rows), max(row[i] for row in rows))
+                  for i in range(len(rows[0]))]
+        # 随机创建k个中心点
+        clusters = [[random.random() * (ranges[i][1] - ranges[i][0]) + ranges[i][0]
+                     for i in range(len(rows[0]))] for j in range(k)]
+    if distance in batchDistances:
+        data = rowMatrices.get(distance, asMatrix)(rows)
 
     bestmatches, lastMatches = None, None
     for t in range(100):
         print 'Iteration %d' % t
         bestmatches = [[] for i in range(k)]
         # 在每一行中寻找距离最近的中心点
-        for j in range(len(rows)):
-            row = rows[j]
-            bestmatch = 0
-            for i in range(k):
-                d = distance(clusters[i], row)
-                if d < distance(clusters[bestmatch], row):
-                    bestmatch = i
-            bestmatches[bestmatch].append(j)
+        if distance in batchDistances:
+            nearest = np.argmin(batchDistances[distance](clusters, data), axis=0)
+            for j in range(len(rows)):
+                bestmatches[nearest[j]].append(j)
+        else:
+            for j in range(len(rows)):
+                row = rows[j]
+                bestmatch = 0
+                bestd = distance(clusters[0], row)
+                for i in range(1, k):
+                    d = distance(clusters[i], row)
+                    if d < bestd:
+                        bestmatch, bestd = i, d
+                bestmatches[bestmatch].append(j)
         # 如果结果与上一次相同，则整个过程结束
         if bestmatches == lastMatches:
             break
         lastMatches = bestmatches
         for i in range(k):
+            if centroid is not None:
+                if len(bestmatches[i]) > 0:
+                    clusters[i] = centroid([rows[rowid] for rowid in bestmatches[i]])
+                continue
             avgs = [0.0] * len(rows[0])
             if len(bestmatches[i]) > 0:
                 for rowid in bestmatches[i]:
@@ -201,48 +629,311 @@ def tanamoto(v1, v2):
     return 1.0 - (float(shr) / (c1 + c2 - shr))
 
 
-# MDS降维
-def MDS(data, distance=pearson, rate=0.01):
-    n = len(data)
+# 稀疏矩阵保持稀疏（CSR格式），由稀疏的行组成的列表也拼接为稀疏矩阵
+def asMatrix(rows):
+    if sparse.issparse(rows):
+        return rows.tocsr().astype(np.float64)
+    if isinstance(rows, list) and len(rows) > 0 and sparse.issparse(rows[0]):
+        return sparse.vstack(rows).tocsr().astype(np.float64)
+    return np.asarray(rows, dtype=np.float64)
+
+
+def numRows(rows):
+    return rows.shape[0] if sparse.issparse(rows) else len(rows)
+
+
+# 以下三个函数对稠密数组和稀疏矩阵都适用
+def _rowSums(X):
+    return np.asarray(X.sum(axis=1)).ravel()
+
+
+def _rowSquareSums(X):
+    return _rowSums(X.multiply(X) if sparse.issparse(X) else X * X)
+
+
+# A·B的转置，结果总是稠密数组
+def _dotT(A, B):
+    if sparse.issparse(A):
+        product = A.dot(B.T)
+        return product.toarray() if sparse.issparse(product) else np.asarray(product)
+    if sparse.issparse(B):
+        return np.asarray(B.dot(A.T)).T
+    return np.dot(A, B.T)
+
+
+# pearson的批量版本：A中每一行与B中每一行的距离。
+# 先把每行减去均值，相关系数就是中心化后的向量夹角的余弦
+def pearsonMatrix(A, B):
+    A = asMatrix(A)
+    B = asMatrix(B)
+    if sparse.issparse(A) or sparse.issparse(B):
+        return _sparsePearson(A, B)
+    Ac = A - A.mean(axis=1)[:, np.newaxis]
+    Bc = B - B.mean(axis=1)[:, np.newaxis]
+    num = np.dot(Ac, Bc.T)
+    den = np.outer(np.sqrt((Ac * Ac).sum(axis=1)), np.sqrt((Bc * Bc).sum(axis=1)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 与pearson相同，分母为0时距离为0
+        return np.where(den > 0, 1.0 - num / den, 0.0)
+
+
+# 稀疏矩阵不能减去均值（会变成稠密的），改用与pearson相同的求和公式：
+# 分子 pSum - sum1 * sum2 / n，分母 sqrt((sum1Sq - sum1^2 / n) * (sum2Sq - sum2^2 / n))
+def _sparsePearson(A, B):
+    n = A.shape[1]
+    sumA, sumB = _rowSums(A), _rowSums(B)
+    num = _dotT(A, B) - np.outer(sumA, sumB) / n
+    den = np.sqrt(np.outer(np.maximum(_rowSquareSums(A) - sumA ** 2 / n, 0),
+                           np.maximum(_rowSquareSums(B) - sumB ** 2 / n, 0)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, 1.0 - num / den, 0.0)
+
+
+# tanamoto的批量版本：用0/1矩阵的乘积得到共同的非零项个数
+def tanamotoMatrix(A, B):
+    X = (asMatrix(A) != 0).astype(np.float64)
+    Y = (asMatrix(B) != 0).astype(np.float64)
+    shr = _dotT(X, Y)
+    union = _rowSums(X)[:, np.newaxis] + _rowSums(Y)[np.newaxis, :] - shr
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 两行都没有非零项时tanamoto会除零，这里视为完全相同
+        return np.where(union > 0, 1.0 - shr / union, 0.0)
+
+
+# 标量距离函数与对应的批量版本
+batchDistances = {pearson: pearsonMatrix, tanamoto: tanamotoMatrix}
+
+# 不使用浮点数列表表示行的距离函数（例如bitset中的tanamotoBits）在这里注册：
+# 批量计算前转换整组行的函数（默认为asMatrix）、hCluster中合并两个聚类的函数
+# （默认取平均值），以及kCluster中由成员计算中心点的函数（默认取平均值）
+rowMatrices = {}
+mergeFunctions = {}
+centroidFunctions = {}
+
+
+# 返回距离函数的批量版本，没有注册批量版本的函数逐对调用
+def batchFor(distance):
+    if distance in batchDistances:
+        return batchDistances[distance]
+    return lambda A, B: np.array([[distance(a, b) for b in B] for a in A])
+
+
+# 计算完整的距离矩阵，可以传给hCluster、hClusterLinkage和MDS的dist参数
+def distanceMatrix(rows, distance=pearson, blocksize=256):
+    n = numRows(rows)
+    if distance not in batchDistances:
+        return squareDistances(condensedDistances(rows, distance), n)
+    data = rowMatrices.get(distance, asMatrix)(rows)
+    dist = np.empty((n, n))
+    for start in range(0, n, blocksize):
+        dist[start : start + blocksize] = batchDistances[distance](data[start : start + blocksize], data)
+    np.fill_diagonal(dist, 0.0)
+    return dist
+
+
+# 单次k-means：k-means++选取初始中心点，向量化地分配数据点，
+# 只根据改变了所属聚类的数据点增量更新中心点，中心点的移动小于tol时结束
+# k-means++：按到已选中心点最近距离的平方为概率选取下一个中心点。
+# batch是批量距离函数（见batchFor），返回选中的k个行下标
+def kMeansPlusPlus(data, k, batch, rng):
+    n = numRows(data)
+    centers = [rng.randint(n)]
+    nearest = batch(data[centers[0] : centers[0] + 1], data)[0]
+    for c in range(1, k):
+        weights = np.maximum(nearest, 0) ** 2
+        total = weights.sum()
+        pick = rng.choice(n, p=weights / total) if total > 0 else rng.randint(n)
+        centers.append(pick)
+        nearest = np.minimum(nearest, batch(data[pick : pick + 1], data)[0])
+    return centers
+
+
+def _kMeansRun(data, distance, k, tol, maxIter, seed):
+    batch = batchFor(distance)
+    rng = np.random.RandomState(seed)
+    n = numRows(data)
+    centers = kMeansPlusPlus(data, k, batch, rng)
+    centroids = data[centers].toarray() if sparse.issparse(data) else data[centers].copy()
+
+    labels = None
+    sums = np.zeros_like(centroids)
+    counts = np.zeros(k)
+    for t in range(maxIter):
+        dist = batch(centroids, data)
+        newLabels = np.argmin(dist, axis=0)
+        if labels is None:
+            _addRows(sums, newLabels, data)
+            np.add.at(counts, newLabels, 1)
+        else:
+            moved = np.flatnonzero(newLabels != labels)
+            if len(moved) == 0:
+                break
+            _addRows(sums, labels[moved], data[moved], -1)
+            np.add.at(counts, labels[moved], -1)
+            _addRows(sums, newLabels[moved], data[moved])
+            np.add.at(counts, newLabels[moved], 1)
+        labels = newLabels
+        # 没有数据点的聚类保留原来的中心点
+        filled = counts > 0
+        updated = centroids.copy()
+        updated[filled] = sums[filled] / counts[filled][:, np.newaxis]
+        shift = np.abs(updated - centroids).max()
+        centroids = updated
+        if shift < tol:
+            break
+    dist = batch(centroids, data)
+    labels = np.argmin(dist, axis=0)
+    inertia = float(dist[labels, np.arange(n)].sum())
+    return inertia, labels
+
+
+# sums[labels[i]] += sign * rows[i]，rows可以是稀疏矩阵
+def _addRows(sums, labels, rows, sign=1):
+    if sparse.issparse(rows):
+        onehot = sparse.csr_matrix((np.repeat(float(sign), len(labels)), (labels, np.arange(len(labels)))),
+                                   shape=(len(sums), rows.shape[0]))
+        sums += onehot.dot(rows).toarray()
+    else:
+        np.add.at(sums, labels, sign * rows)
+
+
+_kMeansShared = {}
+
+
+def _kMeansInit(data, distance, k, tol, maxIter):
+    _kMeansShared.update(data=data, distance=distance, k=k, tol=tol, maxIter=maxIter)
+
+
+def _kMeansTask(seed):
+    s = _kMeansShared
+    return _kMeansRun(s['data'], s['distance'], s['k'], s['tol'], s['maxIter'], seed)
+
+
+# 多次重启的k-means，每次重启在单独的进程中运行，保留总距离（inertia）最小的结果。
+# 返回值与kCluster相同：每个聚类中数据行下标的列表
+def kClusterPlus(rows, distance=pearson, k=4, restarts=8, processes=None,
+                 tol=1e-4, maxIter=100, seed=None):
+    data = asMatrix(rows)
+    seeds = np.random.RandomState(seed).randint(2 ** 31 - 1, size=restarts)
+    if processes == 1 or restarts == 1:
+        results = [_kMeansRun(data, distance, k, tol, maxIter, s) for s in seeds]
+    else:
+        pool = multiprocessing.Pool(processes, _kMeansInit, (data, distance, k, tol, maxIter))
+        try:
+            results = pool.map(_kMeansTask, seeds)
+        finally:
+            pool.close()
+            pool.join()
+    inertia, labels = min(results, key=lambda result: result[0])
+    return [np.flatnonzero(labels == i).tolist() for i in range(k)]
+
+
+# MDS降维。与书中的算法相同：每一步按“投影距离与真实距离之差的百分比”移动节点，
+# 总误差变大时结束，但距离和梯度用矩阵运算一次算出。
+# 梯度 grad[k] = sum_j (loc[k] - loc[j]) * w[k, j]，其中 w = errorterm / fakedist，
+# 可以写成 loc * w.sum(1) - w·loc，不需要n×n×2的中间数组
+def MDS(data, distance=pearson, rate=0.01, dist=None, verbose=False):
+    n = numRows(data)
     # 每一对数据项之间的真实距离
-    realdist = [[distance(data[i], data[j]) for j in range(n)] for i in range(n)]
-    outersum = 0.0
+    if dist is None:
+        dist = distanceMatrix(data, distance)
+    realdist = squareDistances(dist, n)
     # 随机初始化节点在二维空间中的位置
-    loc = [[random.random(), random.random()] for i in range(n)]
-    fakedist = [[0.0 for j in range(n)] for i in range(n)]
+    loc = np.array([[random.random(), random.random()] for i in range(n)])
+    offdiag = ~np.eye(n, dtype=bool)
+    # 真实距离为0的配对（完全相同的两行）不参与计算
+    valid = offdiag & (realdist != 0)
+    safeReal = np.where(valid, realdist, 1.0)
 
     lasterror = None
     for m in range(0, 1000):
         # 寻找投影后的距离
-        for i in range(n):
-            for j in range(n):
-                fakedist[i][j] = sqrt(sum([pow(loc[i][x] - loc[j][x], 2)
-                                           for x in range(len(loc[i]))]))
-        # 移动节点
-        grad = [[0.0, 0.0] for i in range(n)]
-
-        totalerror = 0
-        for k in range(n):
-            for j in range(n):
-                if j == k: continue
-                # 误差值等于目标距离与当前距离之差的百分比
-                errorterm = (fakedist[j][k] - realdist[j][k]) / realdist[j][k]
-                # 每一个节点都需要根据误差的多少，按比例移离或移向其他节点
-                grad[k][0] += ((loc[k][0] - loc[j][0]) / fakedist[j][k]) * errorterm
-                grad[k][1] += ((loc[k][1] - loc[j][1]) / fakedist[j][k]) * errorterm
-
-                # 记录总误差
-                totalerror += abs(errorterm)
-        print totalerror
+        fakedist = _pointDistances(loc)
+        # 误差值等于目标距离与当前距离之差的百分比
+        errorterm = np.where(valid, (fakedist - realdist) / safeReal, 0.0)
+        totalerror = np.abs(errorterm).sum()
+        if verbose:
+            print totalerror
         # 如果节点移动之后的情况变得更糟，则程序结束
         if lasterror and lasterror < totalerror: break
         lasterror = totalerror
 
+        # 每一个节点都需要根据误差的多少，按比例移离或移向其他节点
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.where(fakedist > 0, errorterm / fakedist, 0.0)
+        grad = loc * w.sum(axis=1)[:, np.newaxis] - np.dot(w, loc)
         # 根据rate参数与grad值相乘的结果，移动每一个节点
-        for k in range(n):
-            loc[k][0] -= rate * grad[k][0]
-            loc[k][1] -= rate * grad[k][1]
-    return loc
+        loc -= rate * grad
+    return loc.tolist()
+
+
+# 二维坐标之间的欧式距离矩阵
+def _pointDistances(loc):
+    sq = (loc * loc).sum(axis=1)
+    d2 = sq[:, np.newaxis] + sq[np.newaxis, :] - 2 * np.dot(loc, loc.T)
+    return np.sqrt(np.maximum(d2, 0))
+
+
+# SMACOF求解MDS：反复做Guttman变换，应力（投影距离与真实距离之差的平方和）单调下降，
+# 相对下降量小于eps时结束
+def smacof(data, distance=pearson, dim=2, maxIter=300, eps=1e-6, dist=None, init=None):
+    n = numRows(data)
+    if dist is None:
+        dist = distanceMatrix(data, distance)
+    realdist = squareDistances(dist, n)
+    if init is None:
+        loc = np.array([[random.random() for x in range(dim)] for i in range(n)])
+    else:
+        loc = np.array(init, dtype=np.float64)
+    offdiag = ~np.eye(n, dtype=bool)
+
+    laststress = None
+    for m in range(maxIter):
+        fakedist = _pointDistances(loc)
+        stress = ((fakedist - realdist)[offdiag] ** 2).sum() / 2
+        if laststress is not None and laststress - stress < eps * laststress:
+            break
+        laststress = stress
+        with np.errstate(divide='ignore', invalid='ignore'):
+            B = np.where(offdiag & (fakedist > 0), -realdist / fakedist, 0.0)
+        B[np.diag_indices(n)] = -B.sum(axis=1)
+        loc = np.dot(B, loc) / n
+    return loc.tolist()
+
+
+# 地标（landmark）MDS：只对m个地标做经典MDS，其余数据点根据到地标的距离三角定位，
+# 距离计算和内存都是O(n·m)，可以投影整个语料库
+def landmarkMDS(data, distance=pearson, landmarks=100, dim=2, blocksize=1024, seed=None):
+    rows = asMatrix(data)
+    n = numRows(rows)
+    m = min(landmarks, n)
+    batch = batchFor(distance)
+    # 最远点采样选取地标，使地标尽量分散
+    rng = np.random.RandomState(seed)
+    chosen = [rng.randint(n)]
+    nearest = batch(rows[chosen[0] : chosen[0] + 1], rows)[0]
+    for i in range(1, m):
+        pick = int(np.argmax(nearest))
+        chosen.append(pick)
+        nearest = np.minimum(nearest, batch(rows[pick : pick + 1], rows)[0])
+    marks = rows[chosen]
+
+    # 在地标上做经典MDS：对距离平方矩阵双中心化后做特征分解
+    delta2 = batch(marks, marks) ** 2
+    np.fill_diagonal(delta2, 0.0)
+    J = np.eye(m) - 1.0 / m
+    values, vectors = np.linalg.eigh(-0.5 * np.dot(np.dot(J, delta2), J))
+    top = np.argsort(values)[::-1][:dim]
+    values = np.maximum(values[top], 1e-12)
+    vectors = vectors[:, top]
+    pseudo = (vectors / np.sqrt(values)).T
+    mean = delta2.mean(axis=0)
+
+    loc = np.empty((n, dim))
+    for start in range(0, n, blocksize):
+        d2 = batch(rows[start : start + blocksize], marks) ** 2
+        loc[start : start + blocksize] = -0.5 * np.dot(d2 - mean, pseudo.T)
+    return loc.tolist()
 
 
 def draw2d(data, labels, jpeg='mds2d.jpg'):
@@ -0,0 +1,164 @@
+# -*- coding:utf-8 -*-
+
+# 把hCluster（或hClusterLinkage、hClusterCanopy）返回的biCluster树编译成数组，
+# 之后的查询不需要再递归遍历整棵树：
+#
+#     tree = ClusterTree(hCluster(data))
+#     tree.cut(threshold=0.8)            # 按距离阈值切分，返回每个聚类的行下标列表
+#     tree.cut(k=10)                     # 切分成k个聚类
+#     tree.clusterOf(3, threshold=0.8)   # 第3行所在的聚类，O(log n)
+#     tree.cophenetic(3, 7)              # 两行在树中合并时的距离，O(log n)
+#     tree.members(-5)                   # 某个分支下的所有叶节点，O(结果的大小)
+#
+# 节点仍然用biCluster的id表示：叶节点为行下标，分支节点为负数。
+
+import heapq
+import numpy as np
+
+
+class ClusterTree:
+    def __init__(self, clust):
+        # 先序遍历，左子树在前，叶节点的先后顺序就是树状图中从上到下的顺序。
+        # 节点在先序中的位置作为数组下标，每棵子树占据一段连续的位置
+        nodes = []
+        parents = []
+        stack = [(clust, -1)]
+        while stack:
+            node, parent = stack.pop()
+            parents.append(parent)
+            nodes.append(node)
+            if node.left != None:
+                stack.append((node.right, len(nodes) - 1))
+                stack.append((node.left, len(nodes) - 1))
+        m = len(nodes)
+
+        self.ids = np.array([node.id for node in nodes])
+        self.index = dict((node.id, i) for i, node in enumerate(nodes))
+        self.parent = np.array(parents)
+        self.parent[0] = 0
+        self.height = np.array([node.distance if node.left != None else 0.0 for node in nodes])
+        isLeaf = np.array([node.left == None for node in nodes])
+        self.left = np.array([self.index[node.left.id] if node.left != None else -1 for node in nodes])
+        self.right = np.array([self.index[node.right.id] if node.left != None else -1 for node in nodes])
+
+        # 叶节点的顺序，以及每个节点的第一个叶节点在其中的位置
+        self.order = self.ids[isLeaf]
+        self.start = np.cumsum(isLeaf) - isLeaf
+
+        # 子树的叶节点数和最大合并距离。centroid连接或拼接的树中，子节点的合并距离
+        # 可能大于父节点，所以切分时使用子树中的最大距离，它沿着到根的路径单调不减
+        self.size = np.ones(m, dtype=int)
+        self.maxHeight = self.height.copy()
+        for i in range(m - 1, -1, -1):
+            if not isLeaf[i]:
+                l, r = self.left[i], self.right[i]
+                self.size[i] = self.size[l] + self.size[r]
+                self.maxHeight[i] = max(self.height[i], self.maxHeight[l], self.maxHeight[r])
+
+        # 倍增表：up[j][i]是节点i向上第2^j个祖先（根的祖先是它自己）
+        self.depth = np.zeros(m, dtype=int)
+        for i in range(1, m):
+            self.depth[i] = self.depth[self.parent[i]] + 1
+        up = [self.parent]
+        while (1 << len(up)) <= self.depth.max():
+            up.append(up[-1][up[-1]])
+        self.up = [level.tolist() for level in up]
+        self._depth = self.depth.tolist()
+        self._maxHeight = self.maxHeight.tolist()
+
+    def __len__(self):
+        return len(self.order)
+
+    def _lca(self, a, b):
+        depth = self._depth
+        if depth[a] < depth[b]:
+            a, b = b, a
+        diff = depth[a] - depth[b]
+        j = 0
+        while diff:
+            if diff & 1:
+                a = self.up[j][a]
+            diff >>= 1
+            j += 1
+        if a == b:
+            return a
+        for j in range(len(self.up) - 1, -1, -1):
+            if self.up[j][a] != self.up[j][b]:
+                a, b = self.up[j][a], self.up[j][b]
+        return self.up[0][a]
+
+    def lca(self, a, b):
+        """
+        :return: 节点a和b的最近公共祖先的id
+        """
+        return int(self.ids[self._lca(self.index[a], self.index[b])])
+
+    def cophenetic(self, a, b):
+        """
+        :return: 叶节点a和b被合并到同一个聚类时的距离
+        """
+        if a == b:
+            return 0.0
+        return float(self.height[self._lca(self.index[a], self.index[b])])
+
+    def members(self, node):
+        """
+        :return: 节点下的所有叶节点id，按树状图中的顺序
+        """
+        i = self.index[node]
+        return self.order[self.start[i] : self.start[i] + self.size[i]].tolist()
+
+    def clusterOf(self, leaf, threshold):
+        """
+        :return: 按threshold切分时leaf所在聚类的根节点id
+        """
+        i = self.index[leaf]
+        for j in range(len(self.up) - 1, -1, -1):
+            ancestor = self.up[j][i]
+            if self._maxHeight[ancestor] <= threshold:
+                i = ancestor
+        return int(self.ids[i])
+
+    def cutNodes(self, threshold=None, k=None):
+        """
+        切分成扁平的聚类，只访问结果中的节点及其祖先
+        :param threshold: 每个聚类内部的合并距离都不超过threshold
+        :param k: 聚类的个数，依次拆开最大合并距离最大的聚类
+        :return: 各聚类根节点的id列表，按树状图中的顺序
+        """
+        if (threshold is None) == (k is None):
+            raise ValueError('specify exactly one of threshold and k')
+        if threshold is not None:
+            result = []
+            stack = [0]
+            while stack:
+                i = stack.pop()
+                if self._maxHeight[i] <= threshold or self.left[i] < 0:
+                    result.append(i)
+                else:
+                    stack.append(self.right[i])
+                    stack.append(self.left[i])
+            return self.ids[result].tolist()
+
+        # 距离相同时先拆开分支节点，堆顶是叶节点说明已经无法再拆
+        heap = [(-self._maxHeight[0], self.left[0] < 0, 0)]
+        while len(heap) < k and not heap[0][1]:
+            h, leaf, i = heapq.heappop(heap)
+            for child in (self.left[i], self.right[i]):
+                heapq.heappush(heap, (-self._maxHeight[child], self.left[child] < 0, child))
+        return self.ids[sorted(i for h, leaf, i in heap)].tolist()
+
+    def cut(self, threshold=None, k=None):
+        """
+        :return: 与kCluster相同的格式：每个聚类中叶节点id（行下标）的列表
+        """
+        return [self.members(node) for node in self.cutNodes(threshold, k)]
+
+    def labels(self, threshold=None, k=None):
+        """
+        :return: 每个叶节点所属聚类的编号，按叶节点id排列
+        """
+        labels = np.empty(self.order.max() + 1, dtype=int)
+        for c, node in enumerate(self.cutNodes(threshold, k)):
+            labels[self.members(node)] = c
+        return labels
@@ -0,0 +1,191 @@
+# -*- coding:utf-8 -*-
+
+# 并发下载订阅源，带有遵循ETag/Last-Modified的磁盘缓存。
+# 生成语料库的瓶颈在网络延迟而不是CPU，所以用一组线程同时下载，
+# 每个主机同时最多perHost个连接，每个请求都有超时。
+# 缓存中已有的订阅源发送条件请求，没有变化时服务器只返回304；
+# 设置了maxAge时，足够新的缓存完全不访问网络：
+#
+#     cache = FeedCache('feedcache')
+#     for result in fetchAll(urls, cache, workers=16):
+#         if result.error:
+#             print 'Failed to fetch feed %s: %s' % (result.url, result.error)
+#         else:
+#             feedparser.parse(result.body)
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib2
+import urlparse
+from collections import deque
+
+
+class FetchResult:
+    def __init__(self, url, status=None, body=None, error=None, fromCache=False):
+        self.url = url
+        # HTTP状态码，直接使用缓存时为None
+        self.status = status
+        self.body = body
+        # 失败的原因；有旧的缓存时body仍然是缓存的内容
+        self.error = error
+        self.fromCache = fromCache
+
+
+# 每个订阅源对应目录中的两个文件：<sha1>.xml保存内容，<sha1>.json保存url、
+# ETag、Last-Modified和下载时间
+class FeedCache:
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, url, ext):
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest() + ext)
+
+    def get(self, url):
+        """
+        :return: (元数据, 内容)，没有缓存时返回(None, None)
+        """
+        try:
+            meta = json.load(open(self._path(url, '.json')))
+            body = open(self._path(url, '.xml'), 'rb').read()
+        except (IOError, ValueError):
+            return None, None
+        return meta, body
+
+    def put(self, url, body, etag=None, modified=None):
+        """
+        保存新的内容。元数据只取这次响应的头，旧的ETag/Last-Modified对应的是旧的内容，
+        不能保留，否则之后的条件请求会与缓存的内容不符
+        """
+        self._write(self._path(url, '.xml'), body)
+        self._writeMeta(url, {}, etag, modified)
+
+    def touch(self, url, etag=None, modified=None):
+        """
+        只更新元数据（收到304时），内容没有变化，保留原有的头
+        """
+        meta, body = self.get(url)
+        self._writeMeta(url, meta or {}, etag, modified)
+
+    def _writeMeta(self, url, meta, etag, modified):
+        meta.update(url=url, fetched=time.time())
+        if etag is not None:
+            meta['etag'] = etag
+        if modified is not None:
+            meta['modified'] = modified
+        self._write(self._path(url, '.json'), json.dumps(meta))
+
+    def _write(self, path, data):
+        # 先写临时文件再改名，其他线程或进程不会读到写了一半的文件
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+        out = open(tmp, 'wb')
+        try:
+            out.write(data)
+        finally:
+            out.close()
+        os.rename(tmp, path)
+
+
+def fetchFeed(url, cache=None, timeout=30, maxAge=None):
+    """
+    下载一个订阅源
+    :param url:
+    :param cache: FeedCache，None表示不使用缓存
+    :param timeout: 连接和读取的超时秒数
+    :param maxAge: 缓存在这么多秒以内的订阅源直接使用缓存，None表示总是发送条件请求
+    :return: FetchResult
+    """
+    meta, cached = cache.get(url) if cache else (None, None)
+    if cached is not None and maxAge is not None and time.time() - meta.get('fetched', 0) < maxAge:
+        return FetchResult(url, body=cached, fromCache=True)
+
+    request = urllib2.Request(url, headers={'User-Agent': 'generatefeedvector'})
+    if cached is not None:
+        if meta.get('etag'):
+            request.add_header('If-None-Match', meta['etag'])
+        if meta.get('modified'):
+            request.add_header('If-Modified-Since', meta['modified'])
+    try:
+        response = urllib2.urlopen(request, timeout=timeout)
+        try:
+            body = response.read()
+            headers = response.info()
+            status = response.getcode()
+        finally:
+            response.close()
+    except urllib2.HTTPError as e:
+        if e.code == 304 and cached is not None:
+            cache.touch(url)
+            return FetchResult(url, 304, cached, fromCache=True)
+        return FetchResult(url, e.code, cached, 'HTTP %d %s' % (e.code, e.msg), cached is not None)
+    except Exception as e:
+        # URLError、socket.timeout、连接被重置等
+        return FetchResult(url, None, cached, '%s: %s' % (type(e).__name__, e), cached is not None)
+
+    if cache:
+        cache.put(url, body, headers.getheader('ETag'), headers.getheader('Last-Modified'))
+    return FetchResult(url, status, body)
+
+
+def fetchAll(urls, cache=None, workers=16, perHost=2, timeout=30, maxAge=None, progress=None):
+    """
+    用workers个线程并发下载urls中的订阅源
+    :param perHost: 每个主机同时最多的连接数
+    :param progress: 每完成一个订阅源调用一次progress(FetchResult)
+    :return: 与urls顺序相同的FetchResult列表
+    """
+    urls = [url.strip() for url in urls if url.strip()]
+    results = [None] * len(urls)
+    # 每个主机一个队列。某个主机的连接数已满时线程先去下载其他主机的订阅源，
+    # 所有主机都满了才等待，不会占着线程阻塞在一个主机上
+    queues = {}
+    for i, url in enumerate(urls):
+        queues.setdefault(urlparse.urlparse(url).netloc, deque()).append((i, url))
+    running = dict((host, 0) for host in queues)
+    condition = threading.Condition()
+    lock = threading.Lock()
+
+    def take():
+        with condition:
+            while queues:
+                ready = [host for host in queues if running[host] < perHost]
+                if ready:
+                    # 尽量按urls中的顺序下载
+                    host = min(ready, key=lambda host: queues[host][0][0])
+                    i, url = queues[host].popleft()
+                    if not queues[host]:
+                        del queues[host]
+                    running[host] += 1
+                    return host, i, url
+                condition.wait()
+            return None
+
+    def worker():
+        while True:
+            task = take()
+            if task is None:
+                return
+            host, i, url = task
+            try:
+                results[i] = fetchFeed(url, cache, timeout, maxAge)
+            except Exception as e:
+                results[i] = FetchResult(url, error='%s: %s' % (type(e).__name__, e))
+            finally:
+                with condition:
+                    running[host] -= 1
+                    condition.notify_all()
+            if progress:
+                with lock:
+                    progress(results[i])
+
+    threads = [threading.Thread(target=worker) for w in range(min(workers, len(urls)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
@@ -0,0 +1,267 @@
+# -*- coding:utf-8 -*-
+
+# 博客-单词矩阵的稀疏存储格式，文件大小与非零项个数成正比。
+# 一个矩阵由前缀相同的三个文本文件组成：
+#
+#     blogdata.rows    每行一个行名（博客标题）
+#     blogdata.vocab   每行一个列名（单词）
+#     blogdata.coo     每行一个非零项：行号\t列号\t值，按行号排序
+#
+# generatefeedvector逐个订阅源写入这种格式，cluster.readFile可以直接读取。
+#
+# loadMatrix把这种格式或blogdata.txt格式的矩阵读成紧凑的float32数组（大部分为0时为
+# 稀疏矩阵），并在源文件旁边写入二进制缓存，之后的载入直接内存映射缓存文件：
+#
+#     blognames, words, data = loadMatrix('blogdata.txt')
+
+import os
+import zipfile
+import numpy as np
+from scipy import sparse
+
+CACHE_VERSION = 2
+
+
+def sparseFiles(base):
+    return base + '.rows', base + '.vocab', base + '.coo'
+
+
+# base是否是稀疏格式的前缀（也可以传入三个文件中的任意一个）
+def isSparse(filename):
+    return all(os.path.exists(path) for path in sparseFiles(sparseBase(filename)))
+
+
+def sparseBase(filename):
+    for ext in ('.rows', '.vocab', '.coo'):
+        if filename.endswith(ext):
+            return filename[: -len(ext)]
+    return filename
+
+
+# 名称中的制表符和换行符会破坏文件格式，替换为空格
+def cleanName(name):
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return ' '.join(name.split())
+
+
+def _readNames(path):
+    f = open(path)
+    try:
+        return [line.rstrip('\n') for line in f]
+    finally:
+        f.close()
+
+
+class SparseWriter:
+    """
+    逐行写入稀疏矩阵，内存占用只与当前行有关：
+
+        writer = SparseWriter('blogdata', wordlist)
+        writer.addRow(title, {列号: 值, ...})
+        writer.close()
+    """
+    def __init__(self, base, colnames):
+        rows, vocab, coo = sparseFiles(base)
+        out = open(vocab, 'w')
+        try:
+            for name in colnames:
+                out.write('%s\n' % cleanName(name))
+        finally:
+            out.close()
+        self.rows = open(rows, 'w')
+        self.coo = open(coo, 'w')
+        self.count = 0
+        self.nnz = 0
+
+    def addRow(self, name, entries):
+        self.rows.write('%s\n' % cleanName(name))
+        for col in sorted(entries):
+            if entries[col] != 0:
+                self.coo.write('%d\t%d\t%s\n' % (self.count, col, entries[col]))
+                self.nnz += 1
+        self.count += 1
+
+    def close(self):
+        self.rows.close()
+        self.coo.close()
+
+
+def writeSparse(base, rownames, colnames, matrix):
+    matrix = sparse.csr_matrix(matrix)
+    writer = SparseWriter(base, colnames)
+    try:
+        for i in range(len(rownames)):
+            row = matrix.getrow(i)
+            writer.addRow(rownames[i], dict(zip(row.indices.tolist(), row.data.tolist())))
+    finally:
+        writer.close()
+
+
+def readSparse(base):
+    """
+    :return: (行名列表, 列名列表, scipy.sparse.csr_matrix)
+    """
+    rows, vocab, coo = sparseFiles(sparseBase(base))
+    rownames = _readNames(rows)
+    colnames = _readNames(vocab)
+    f = open(coo)
+    try:
+        # 以任意空白字符分隔，一次解析所有数字
+        values = np.fromstring(f.read(), sep=' ').reshape(-1, 3)
+    finally:
+        f.close()
+    matrix = sparse.coo_matrix((values[:, 2], (values[:, 0].astype(int), values[:, 1].astype(int))),
+                               shape=(len(rownames), len(colnames)))
+    return rownames, colnames, matrix.tocsr()
+
+
+# 写成与blogdata.txt相同的稠密格式，兼容只能读取这种格式的程序
+def writeDense(filename, rownames, colnames, matrix):
+    matrix = sparse.csr_matrix(matrix)
+    out = open(filename, 'w')
+    try:
+        out.write('Blog')
+        for name in colnames:
+            out.write('\t%s' % cleanName(name))
+        out.write('\n')
+        for i in range(len(rownames)):
+            out.write(cleanName(rownames[i]))
+            for value in matrix.getrow(i).toarray()[0]:
+                out.write('\t%d' % value)
+            out.write('\n')
+    finally:
+        out.close()
+
+
+def _sourceKey(*filenames):
+    key = []
+    for filename in filenames:
+        st = os.stat(filename)
+        key.extend([st.st_mtime, st.st_size])
+    return np.array([CACHE_VERSION] + key, dtype=np.float64)
+
+
+# 逐行解析blogdata.txt格式的文件，每行只保留非零项，
+# 解析过程中的内存与非零项个数成正比
+def _parseDense(filename):
+    f = open(filename)
+    try:
+        colnames = f.readline().rstrip('\r\n').split('\t')[1:]
+        rownames, indices, values = [], [], []
+        for line in f:
+            name, sep, rest = line.rstrip('\r\n').partition('\t')
+            if not name and not rest:
+                continue
+            row = np.fromstring(rest, dtype=np.float32, sep='\t')
+            nonzero = np.flatnonzero(row)
+            rownames.append(name)
+            indices.append(nonzero.astype(np.int32))
+            values.append(row[nonzero])
+    finally:
+        f.close()
+    indptr = np.zeros(len(rownames) + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum([len(index) for index in indices])
+    matrix = sparse.csr_matrix((np.concatenate(values or [np.zeros(0, np.float32)]),
+                                np.concatenate(indices or [np.zeros(0, np.int32)]), indptr),
+                               shape=(len(rownames), len(colnames)))
+    return rownames, colnames, matrix
+
+
+def _cacheFiles(filename):
+    prefix = filename + '.cache'
+    return prefix + '.npz', dict((name, '%s.%s.npy' % (prefix, name)) for name in ('data', 'indices', 'indptr'))
+
+
+# 读取缓存，键不匹配或数组与元数据对不上（例如另一个进程正在写入新的缓存）时返回None
+def _loadCache(metafile, arrays, key):
+    meta = np.load(metafile)
+    try:
+        if not np.array_equal(meta['key'], key):
+            return None
+        names = meta['arrays'].tolist()
+        shape = tuple(meta['shape'].tolist())
+        nnz = int(meta['nnz'])
+        rownames = meta['rownames'].tolist()
+        colnames = meta['colnames'].tolist()
+    finally:
+        meta.close()
+    if not all(os.path.exists(arrays[name]) for name in names):
+        return None
+    loaded = dict((name, np.load(arrays[name], mmap_mode='r')) for name in names)
+    if 'indptr' in loaded:
+        indptr = loaded['indptr']
+        if (len(indptr) != shape[0] + 1 or indptr[-1] != nnz or
+                len(loaded['data']) != nnz or len(loaded['indices']) != nnz):
+            return None
+        data = sparse.csr_matrix((loaded['data'], loaded['indices'], indptr), shape=shape)
+    else:
+        data = loaded['data']
+        if data.shape != shape:
+            return None
+    return rownames, colnames, data
+
+
+def loadMatrix(filename, sparseBelow=0.3, cache=True):
+    """
+    读取blogdata.txt格式或稀疏格式的矩阵
+    :param filename: 文件名，或稀疏格式的前缀
+    :param sparseBelow: 非零项的比例低于该值时返回scipy.sparse.csr_matrix，否则返回稠密数组
+    :param cache: 是否读写二进制缓存。缓存以源文件的修改时间和大小为键，
+                  数组保存为.npy文件，载入时以只读方式内存映射
+    :return: (行名列表, 列名列表, float32的数组或稀疏矩阵)
+    """
+    sources = sparseFiles(sparseBase(filename)) if isSparse(filename) else (filename,)
+    metafile, arrays = _cacheFiles(sparseBase(filename) if isSparse(filename) else filename)
+    key = _sourceKey(*sources)
+
+    if cache and os.path.exists(metafile):
+        try:
+            cached = _loadCache(metafile, arrays, key)
+        except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+            # 缓存损坏或不完整时当作没有缓存
+            cached = None
+        if cached is not None:
+            return cached
+
+    if isSparse(filename):
+        rownames, colnames, matrix = readSparse(filename)
+        matrix = matrix.astype(np.float32)
+    else:
+        rownames, colnames, matrix = _parseDense(filename)
+    size = matrix.shape[0] * matrix.shape[1]
+    if size and float(matrix.nnz) / size < sparseBelow:
+        matrix.sort_indices()
+        stored = {'data': matrix.data, 'indices': matrix.indices.astype(np.int32),
+                  'indptr': matrix.indptr.astype(np.int32)}
+        data = matrix
+    else:
+        data = matrix.toarray()
+        stored = {'data': data}
+
+    if cache:
+        try:
+            for name in stored:
+                # 先写临时文件再改名，不影响正在内存映射旧缓存的进程
+                tmp = '%s.%d.tmp' % (arrays[name], os.getpid())
+                out = open(tmp, 'wb')
+                try:
+                    np.save(out, stored[name])
+                finally:
+                    out.close()
+                os.rename(tmp, arrays[name])
+            # 元数据最后写入，同样先写临时文件再改名
+            tmp = '%s.%d.tmp' % (metafile, os.getpid())
+            out = open(tmp, 'wb')
+            try:
+                np.savez(out, key=key, shape=np.array(matrix.shape), arrays=np.array(sorted(stored)),
+                         nnz=np.array(matrix.nnz),
+                         rownames=np.array(rownames, dtype=np.string_),
+                         colnames=np.array(colnames, dtype=np.string_))
+            finally:
+                out.close()
+            os.rename(tmp, metafile)
+        except (IOError, OSError):
+            # 目录不可写时只是不使用缓存
+            pass
+    return rownames, colnames, data
@@ -2,12 +2,16 @@
 
 import feedparser
 import re
+import tempfile
+from feedfetch import FeedCache, fetchAll
+from feedmatrix import SparseWriter, cleanName
 
 
-# 返回一个RSS订阅源的标题和包含单词计数情况的字典
-def getwordcounts(url):
+# 返回一个RSS订阅源的标题和包含单词计数情况的字典。
+# body为已经下载好的订阅源内容（见feedfetch），为None时由feedparser下载url
+def getwordcounts(url, body=None):
     # 解析订阅源
-    d = feedparser.parse(url)
+    d = feedparser.parse(url if body is None else body)
     wc = {}
     # 循环遍历所有文章条目
     for e in d.entries:
@@ -24,56 +28,90 @@ def getwordcounts(url):
     return d.feed.title, wc
 
 
+# 预先编译的正则表达式：html标记和非字母字符
+TAGS = re.compile(r'<[^>]+>')
+NONALPHA = re.compile(r'[^A-Z^a-z]+')
+
+
 def getwords(html):
     # 去除所有html标记
-    txt = re.compile(r'<[^>]+>').sub('', html)
+    txt = TAGS.sub('', html)
 
     # 利用所有非字母字符拆分出单词
-    words = re.compile(r'[^A-Z^a-z]+').split(txt)
+    words = NONALPHA.split(txt)
 
     # 转化成小写形式
     return [word.lower() for word in words if word != '']
 
 
-if __name__ == '__main__':
-    # 出现这些单词的博客数目
+# 第一遍：逐个解析订阅源，把单词计数写入临时文件spill（每行“标题\t单词 次数\t...”），
+# 内存中只保留apcount（出现这些单词的博客数目）
+def spillWordCounts(results, spill):
     apcount = {}
-    wordcounts = {}
-    feedlist = [line for line in file('feedlist.txt')]
-    for feedurl in feedlist:
+    for result in results:
+        if result.error:
+            print 'Failed to fetch feed %s: %s' % (result.url, result.error)
+            if result.body is None:
+                continue
+            print 'Using cached copy of %s' % result.url
         try:
-            title, wc = getwordcounts(feedurl)
-            wordcounts[title] = wc
-            for word, count in wc.items():
-                apcount.setdefault(word, 0)
-                if count > 1:
-                    apcount[word] += 1
-        except:
-            print 'Failed to parse feed %s' % feedurl
-
-    # 去除常用词
-    wordlist = []
-    for w, bc in apcount.items():
-        frac = float(bc) / len(feedlist)
-        if frac > 0.1 and frac < 0.5:
-            wordlist.append(w)
-
-    # 保存到本地文件
-    out = file('blogdata.txt', 'w')
-    out.write('Blog')
-    for word in wordlist:
-        out.write('\t%s' % word)
-    out.write('\n')
-    for blog, wc in wordcounts.items():
-        print blog
-        out.write(blog)
-        for word in wordlist:
-            if word in wc:
-                out.write('\t%d' % wc[word])
-            else:
-                out.write('\t0')
-        out.write('\n')
-
-
+            title, wc = getwordcounts(result.url, result.body)
+        except Exception as e:
+            print 'Failed to parse feed %s: %s' % (result.url, e)
+            continue
+        print title
+        spill.write(cleanName(title))
+        for word, count in wc.items():
+            spill.write('\t%s %d' % (word, count))
+            apcount.setdefault(word, 0)
+            if count > 1:
+                apcount[word] += 1
+        spill.write('\n')
+    return apcount
+
+
+def buildFeedMatrix(feedlist, base='blogdata', cache='feedcache', low=0.1, high=0.5):
+    """
+    下载feedlist中的订阅源并生成稀疏格式的博客-单词矩阵（见feedmatrix）
+    :param feedlist: 订阅源url列表
+    :param base: 输出文件的前缀
+    :param cache: 订阅源缓存目录，None表示不使用缓存
+    :param low, high: 只保留出现在这个比例范围内的博客中的单词，去除常用词和生僻词
+    :return: (博客数, 单词数, 非零项个数)
+    """
+    spill = tempfile.TemporaryFile()
+    try:
+        apcount = spillWordCounts(fetchAll(feedlist, FeedCache(cache) if cache else None), spill)
+
+        # 去除常用词
+        wordlist = []
+        for w, bc in apcount.items():
+            frac = float(bc) / len(feedlist)
+            if frac > low and frac < high:
+                wordlist.append(w)
+        wordlist.sort()
+        index = dict((w, i) for i, w in enumerate(wordlist))
+
+        # 第二遍：从临时文件读回每个订阅源的计数，只写出保留的单词
+        spill.seek(0)
+        writer = SparseWriter(base, wordlist)
+        try:
+            for line in spill:
+                p = line.rstrip('\n').split('\t')
+                entries = {}
+                for item in p[1:]:
+                    word, count = item.split(' ')
+                    if word in index:
+                        entries[index[word]] = int(count)
+                writer.addRow(p[0], entries)
+        finally:
+            writer.close()
+        return writer.count, len(wordlist), writer.nnz
+    finally:
+        spill.close()
 
 
+if __name__ == '__main__':
+    feedlist = [line for line in open('feedlist.txt') if line.strip()]
+    blogs, words, nnz = buildFeedMatrix(feedlist, 'blogdata')
+    print '%d blogs, %d words, %d non-zero counts' % (blogs, words, nnz)
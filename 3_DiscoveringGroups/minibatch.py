@@ -0,0 +1,93 @@
+# -*- coding:utf-8 -*-
+
+# 小批量（mini-batch）流式k-means。
+# 数据按批读入，每批只用来更新中心点，内存占用与数据总量无关；
+# 新的订阅源可以通过partial_fit继续训练，或者用predict直接分配到已有的聚类：
+#
+#     colnames, chunks = readFileChunks('blogdata.txt', chunksize=1000)
+#     km = MiniBatchKMeans(k=10)
+#     for names, data in chunks:
+#         km.partial_fit(data)
+#     km.predict(newrows)
+#
+# 每批数据可以是稠密数组，也可以是scipy.sparse.csr_matrix（例如稀疏格式的文件，见feedmatrix），
+# 中心点总是稠密数组。
+
+import numpy as np
+from scipy import sparse
+from cluster import pearson, batchFor, kMeansPlusPlus, readFileChunks, asMatrix, numRows, _addRows
+
+
+class MiniBatchKMeans:
+    def __init__(self, k=4, distance=pearson, seed=None):
+        self.k = k
+        self.distance = distance
+        self.batch = batchFor(distance)
+        self.rng = np.random.RandomState(seed)
+        self.centroids = None
+        # 每个中心点累计吸收的数据点个数
+        self.counts = np.zeros(k)
+        # 第一批数据不足k行时先缓存起来
+        self.pending = []
+
+    def _initialize(self, data):
+        # 在第一批数据上用k-means++选取初始中心点
+        centers = kMeansPlusPlus(data, self.k, self.batch, self.rng)
+        self.centroids = data[centers].toarray() if sparse.issparse(data) else data[centers].copy()
+
+    def partial_fit(self, rows):
+        data = asMatrix(rows)
+        if self.centroids is None:
+            self.pending.append(data)
+            if sum(numRows(d) for d in self.pending) < self.k:
+                return self
+            data = sparse.vstack(self.pending).tocsr() if sparse.issparse(data) else np.vstack(self.pending)
+            self.pending = []
+            self._initialize(data)
+
+        labels = self.predict(data)
+        # 每个中心点等于它吸收过的所有数据点的平均值，按批增量更新
+        sums = np.zeros_like(self.centroids)
+        _addRows(sums, labels, data)
+        batchCounts = np.bincount(labels, minlength=self.k)
+        hit = batchCounts > 0
+        self.counts[hit] += batchCounts[hit]
+        self.centroids[hit] += (sums[hit] - batchCounts[hit][:, np.newaxis] * self.centroids[hit]) \
+            / self.counts[hit][:, np.newaxis]
+        return self
+
+    # rows可以是任意的行迭代器，每batchsize行更新一次中心点
+    def fit(self, rows, batchsize=1000):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batchsize:
+                self.partial_fit(batch)
+                batch = []
+        if batch:
+            self.partial_fit(batch)
+        return self
+
+    # 对与readFile格式相同的文件逐块训练，passes为遍历文件的次数
+    def fitFile(self, filename, chunksize=1000, passes=1):
+        for p in range(passes):
+            colnames, chunks = readFileChunks(filename, chunksize)
+            for rownames, data in chunks:
+                self.partial_fit(data)
+        return self
+
+    # 每一行所属的聚类编号
+    def predict(self, rows):
+        data = asMatrix(rows)
+        return np.argmin(self.batch(self.centroids, data), axis=0)
+
+    # 逐块分配文件中的所有行，返回与kCluster相同的格式：每个聚类中行下标的列表
+    def clusterFile(self, filename, chunksize=1000):
+        bestmatches = [[] for i in range(self.k)]
+        colnames, chunks = readFileChunks(filename, chunksize)
+        offset = 0
+        for rownames, data in chunks:
+            for j, label in enumerate(self.predict(data)):
+                bestmatches[label].append(offset + j)
+            offset += numRows(data)
+        return bestmatches